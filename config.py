@@ -2,3 +2,6 @@ import os
 import os.path as osp
 
 MODEL_DIR=os.environ.get("ANDROMEDA", osp.join(osp.dirname(__file__), 'model'))
+
+# directory of the memoization cache, caching is off if not set
+CACHE_DIR=os.environ.get("ANDROMEDA_CACHE", None)
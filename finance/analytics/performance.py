@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 
-from andromeda.finance.analytics.portfolio import roll, equal_weight
+from andromeda.finance.analytics.portfolio import roll
 
 
 def daily_returns(prices):
@@ -152,53 +152,114 @@ def performance_data_list(factor,
                           groups=None,
                           trade_cost=None,
                           neutral=False):
-    rets = []
-    drets = []
+    # equal weight, no roll and each roll of rolls, see roll_sweep
+
+    return roll_sweep(factor,
+                      returns,
+                      rolls=rolls,
+                      groups=groups,
+                      trade_cost=trade_cost,
+                      neutral=neutral)
+
+
+def _window_sum(csum, counts, window):
+    # rolling(window, min_periods=1).sum() from cumulative sums of the values
+    # (nan as 0) and of the non nan counts, both starting with a zero row
+
+    n = len(csum) - 1
+
+    res = csum[1:].copy()
+    known = counts[1:].copy()
+    if window < n:
+        res[window:] -= csum[1:n - window + 1]
+        known[window:] -= counts[1:n - window + 1]
+
+    res[known == 0] = np.nan
+
+    return res
+
+
+def roll_sweep(factor,
+               returns,
+               rolls=[],
+               groups=None,
+               trade_cost=None,
+               neutral=False,
+               leverage=1):
+    """
+    Calculates the returns of the equal weight, no roll and rolled strategies
+    of a factor in one pass, same results as performance_data for each
+    :param factor: factor, datetime indexed, one column per ticker
+    :param returns: daily returns, datetime indexed, one column per ticker
+    :param rolls: list of int, numbers of days to roll the factor
+    :param groups: dataframe, indexed by ticker, with the group of each ticker
+    :param trade_cost: cost per unit of weight traded
+    :param neutral: weight each group to one before weighting the groups
+    :param leverage: multiplier of the strategy weights
+    :return: cumulative returns and daily returns, one column per strategy,
+        and dict of strategy to group weights
+    """
+
+    values = factor.to_numpy(dtype=np.float64)
+    tickers = factor.columns
+
+    # rolled sums of every window from one pair of cumulative sums
+    known = ~np.isnan(values)
+    csum = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(np.where(known, values, 0), axis=0, out=csum[1:])
+    counts = np.zeros(csum.shape, dtype=np.int64)
+    np.cumsum(known, axis=0, out=counts[1:])
+
+    strategies = {'equal weight': lambda: np.ones(values.shape),
+                  'roll-None': lambda: values}
+    for r in rolls:
+        strategies[f'roll-{r}'] = lambda r=r: _window_sum(csum, counts, r)
+
+    # group of each ticker, -1 for tickers without one
+    onehot = None
+    if groups is not None:
+        grp_col = groups.columns[0]
+        codes, names = pd.factorize(groups[grp_col].reindex(tickers), sort=True)
+        onehot = np.zeros((len(tickers), len(names)))
+        onehot[codes >= 0, codes[codes >= 0]] = 1
+        names = pd.Index(names, name=grp_col)
+
+    # returns of each day for the weights of the previous business day,
+    # shared by all strategies
+    index = factor.index.shift(1, 'B')
+    day_returns = returns.reindex(index=index, columns=tickers).to_numpy(dtype=np.float64)
+
+    rets = {}
+    drets = {}
     gwgts = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for title, weights in strategies.items():
+            weights = weights()
+
+            if onehot is not None:
+                if neutral:
+                    group_sums = np.where(np.isnan(weights), 0, weights) @ onehot
+                    weights = np.where(codes >= 0, weights / group_sums[:, np.maximum(codes, 0)], np.nan)
+                gwgts[title] = pd.DataFrame(np.where(np.isnan(weights), 0, weights) @ onehot,
+                                            index=factor.index,
+                                            columns=names)
+            else:
+                gwgts[title] = None
+
+            weights = weights / np.nansum(weights, axis=1, keepdims=True) * leverage
+
+            daily = np.nansum(weights * day_returns, axis=1)
+            if trade_cost is not None:
+                trades = np.full(weights.shape, np.nan)
+                trades[1:] = weights[1:] - weights[:-1]
+                daily = daily - np.nansum(np.abs(trades) * trade_cost, axis=1)
+
+            drets[title] = daily
+            rets[title] = np.cumprod(daily + 1.0)
+
+    rets = pd.DataFrame(rets, index=index)
+    drets = pd.DataFrame(drets, index=index)
 
-    ret, dret, gw = performance_data(equal_weight(factor.index, factor.columns),
-                                     returns,
-                                     title='equal weight',
-                                     groups=groups,
-                                     trade_cost=trade_cost,
-                                     neutral=neutral)
-    rets.append(ret)
-    drets.append(dret)
-    gwgts[ret.name] = gw
-
-    #ret, dret, gw = performance_data(equal_weight(factor.index, factor.columns),
-    #                                 returns,
-    #                                 title='equal weight 1.5',
-    #                                 leverage=1.5,
-    #                                 groups=groups,
-    #                                 trade_cost=trade_cost,
-    #                                 neutral=neutral)
-    #rets.append(ret)
-    #drets.append(dret)
-    #gwgts[ret.name] = gw
-
-    ret, dret, gw = performance_data(factor,
-                                     returns,
-                                     groups=groups,
-                                     trade_cost=trade_cost,
-                                     neutral=neutral)
-    rets.append(ret)
-    drets.append(dret)
-    gwgts[ret.name] = gw
-
-    for roll in rolls:
-        ret, dret, gw = performance_data(factor,
-                                         returns,
-                                         roll,
-                                         groups=groups,
-                                         trade_cost=trade_cost,
-                                         neutral=neutral)
-        rets.append(ret)
-        drets.append(dret)
-        gwgts[ret.name] = gw
-
-    rets = pd.concat(rets, axis=1)
-    drets = pd.concat(drets, axis=1)
     return rets, drets, gwgts
 
 
@@ -214,6 +275,23 @@ def calc_performance(drets, ref):
     return res
 
 
+def factor_frame(values, tickers):
+    """
+    Creates a factor from its values, on every business day of its range
+    :param values: series of factor values, indexed by date and ticker
+    :param tickers: tickers of the factor columns
+    :return: dataframe, indexed by date, one column per ticker
+    """
+
+    factor = values.dropna().unstack()
+
+    factor = factor.reindex(pd.bdate_range(factor.index.min(),
+                                           factor.index.max()))
+    factor = factor.reindex(tickers, axis=1)
+
+    return factor
+
+
 def analyze_factor(factor_name,
                    data,
                    returns,
@@ -222,14 +300,8 @@ def analyze_factor(factor_name,
                    rolls=[2, 5, 8, 10, 13, 15, 100]):
 
     print(f"ANALYZING: {factor_name}")
-    r1 = data[[factor_name]]
-    r1 = r1.dropna()
-    factor = r1[factor_name].unstack()
-
-    factor = factor.reindex(pd.bdate_range(factor.index.min(),
-                                           factor.index.max()))
     returns.columns.name = 'ticker'
-    factor = factor.reindex(returns.columns, axis=1)
+    factor = factor_frame(data[factor_name], returns.columns)
     #print(factor)
 
     rets, drets, gwgts = performance_data_list(factor,
@@ -252,4 +324,128 @@ def analyze_factor(factor_name,
     print("sector neutral:")
     print(calc_performance(drets_n, drets_n['equal weight']))
     #print(drets_n.corr())
-    gwgts_n['roll-None'].tail(300).plot.area(figsize=(10, 5), title=f"{factor_name} Neutralized")
\ No newline at end of file
+    gwgts_n['roll-None'].tail(300).plot.area(figsize=(10, 5), title=f"{factor_name} Neutralized")
+
+
+def _share(array):
+    # copies array to a new shared memory block
+    # returns the block and the spec to attach to it
+
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    # shared memory block of spec and the array on it, without a copy
+
+    from multiprocessing import shared_memory
+
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+_panel = {}
+
+
+def _init_panel(returns_spec, dates, tickers, groups_spec, group_names, group_col):
+    # runs once in every worker, attaches the returns and the groups shared
+    # by analyze_factors, the blocks are kept open for the worker lifetime
+
+    returns_shm, values = _attach(returns_spec)
+    groups_shm, codes = _attach(groups_spec)
+
+    groups = np.where(codes >= 0, np.asarray(group_names, dtype=object)[np.maximum(codes, 0)], np.nan)
+
+    _panel['blocks'] = [returns_shm, groups_shm]
+    _panel['returns'] = pd.DataFrame(values, index=dates, columns=tickers, copy=False)
+    _panel['groups'] = pd.DataFrame({group_col: groups}, index=tickers)
+
+
+def _analyze_chunk(factors, rolls, trade_cost):
+    # sharpe and volatility of the strategies of each factor of a chunk,
+    # without and with group neutralization
+
+    returns = _panel['returns']
+    groups = _panel['groups']
+
+    res = {}
+    for factor_name, values in factors.items():
+        factor = factor_frame(values, returns.columns)
+
+        for neutral in [False, True]:
+            _, drets, _ = performance_data_list(factor,
+                                                returns,
+                                                rolls=rolls,
+                                                trade_cost=trade_cost,
+                                                groups=groups,
+                                                neutral=neutral)
+            res[(factor_name, neutral)] = calc_performance(drets, drets['equal weight'])
+
+    return res
+
+
+def analyze_factors(factor_names,
+                    data,
+                    returns,
+                    sp500_gics,
+                    trade_cost=0,
+                    rolls=[2, 5, 8, 10, 13, 15, 100],
+                    num_workers=4,
+                    verbose=True):
+    """
+    Analyzes many factors in a process pool, as analyze_factor without plots
+    the returns and groups are put in shared memory once and attached by
+    every worker, only the values of its factor are sent with a task
+    :param factor_names: list of factor columns of data
+    :param data: factor values, indexed by date and ticker
+    :param returns: daily returns, datetime indexed, one column per ticker
+    :param sp500_gics: dataframe, indexed by ticker, with the group of each ticker
+    :param trade_cost: cost per unit of weight traded
+    :param rolls: list of int, numbers of days to roll the factors
+    :param num_workers: number of worker processes
+    :param verbose: print progress
+    :return: dataframe of Sharpe and Volatility, indexed by factor, neutral
+        and strategy
+    """
+
+    from andromeda.util import multi_run_iter
+
+    returns.columns.name = 'ticker'
+    tickers = returns.columns
+
+    group_col = sp500_gics.columns[0]
+    codes, group_names = pd.factorize(sp500_gics[group_col].reindex(tickers))
+
+    returns_shm, returns_spec = _share(returns.to_numpy(dtype=np.float64))
+    groups_shm, groups_spec = _share(codes.astype(np.int64))
+
+    tasks = [{factor_name: data[factor_name]} for factor_name in factor_names]
+
+    res = {}
+    try:
+        for r in multi_run_iter(_analyze_chunk,
+                                None,
+                                tasks,
+                                num_workers=num_workers,
+                                verbose=verbose,
+                                initializer=_init_panel,
+                                initargs=(returns_spec, returns.index, tickers,
+                                          groups_spec, list(group_names), group_col),
+                                rolls=rolls,
+                                trade_cost=trade_cost):
+            if r.error is not None:
+                raise RuntimeError(f'failed to analyze {list(tasks[r.idx])}:\n{r.error}')
+            res.update(r.result)
+    finally:
+        for shm in [returns_shm, groups_shm]:
+            shm.close()
+            shm.unlink()
+
+    keys = [(factor_name, neutral) for factor_name in factor_names for neutral in [False, True]]
+    return pd.concat([res[k] for k in keys], keys=keys, names=['factor', 'neutral', 'strategy'])
@@ -1,15 +1,18 @@
+import bisect
 import os.path as osp
+import numpy as np
 import pandas as pd
-from openie import StanfordOpenIE
-import gensim
-from nltk.tag.stanford import StanfordNERTagger
-from nltk.tag.stanford import StanfordPOSTagger
-from nltk.stem import WordNetLemmatizer
-from nltk.stem import PorterStemmer
-from nltk.corpus import stopwords
 
 from andromeda.nlp.util import to_words
+from andromeda.nlp.tagger import TaggerServer
 from andromeda.config import MODEL_DIR
+from andromeda.util.cache import BoundedDict, memoize
+from andromeda.util import read_pickle, write_pickle
+
+
+# openie, gensim and the nltk taggers, stemmers and corpora are imported by
+# create_processor, so importing processors and starting workers stays fast
+# and only the backends used are loaded
 
 
 class Processor:
@@ -26,30 +29,63 @@ class Processor:
     def create_processor(self):
         raise ValueError("create_processor is not defined")
 
+    def config(self):
+        # options the results of process depend on, part of cache keys
+        return ()
+
+    def cache_key(self):
+        # identifies the results of process in cache keys, class and config
+        return type(self).__name__, self.config()
+
     def process(self, *args, **kwargs):
         raise ValueError("process function is not defined")
 
 
 class NERStanford(Processor):
+    # backend:
+    #   None or 'nltk': nltk wrapper, starts java for every call
+    #   'server': long lived TaggerServer, backend_options are passed to it,
+    #     e.g. processes, connections, memory
+    #   any object with tag and tag_sents, e.g. nlp.tagger.FakeTagger
 
-    def __init__(self, jar_path=None, model_path=None):
+    def __init__(self, jar_path=None, model_path=None, backend=None, **backend_options):
         self._jar_path = jar_path \
             if jar_path is not None \
             else osp.join(MODEL_DIR, 'stanford-ner.jar')
         self._model_path = model_path \
             if model_path is not None \
             else osp.join(MODEL_DIR, 'english.all.3class.distsim.crf.ser.gz')
+        self._backend = backend
+        self._backend_options = backend_options
 
         super().__init__()
 
     def create_processor(self):
         jar = self._jar_path
         model = self._model_path
+        if self._backend == 'server':
+            return TaggerServer.ner(jar, model, **self._backend_options)
+        if self._backend is not None and self._backend != 'nltk':
+            return self._backend
+        from nltk.tag.stanford import StanfordNERTagger
         return StanfordNERTagger(model, jar, encoding='utf8')
 
+    def config(self):
+        return self._jar_path, self._model_path
+
     def process(self, words):
         return self.processor.tag(words)
 
+    def process_batch(self, sentences):
+        # tags many token lists in one backend call
+        # returns list of tagged token lists, in the order of sentences
+
+        sentences = [list(words) for words in sentences]
+        non_empty = [words for words in sentences if len(words) > 0]
+        tagged = iter(self.processor.tag_sents(non_empty) if len(non_empty) > 0 else [])
+
+        return [next(tagged) if len(words) > 0 else [] for words in sentences]
+
     @staticmethod
     def nth_ne(words_ner, key, nth=0):
 
@@ -66,61 +102,162 @@ class NERStanford(Processor):
 
 
 class POSStanford(Processor):
+    # backend: see NERStanford
 
-    def __init__(self, jar_path=None, model_path=None):
+    def __init__(self, jar_path=None, model_path=None, backend=None, **backend_options):
         self._jar_path = jar_path \
             if jar_path is not None \
             else osp.join(MODEL_DIR, 'stanford-postagger.jar')
         self._model_path = model_path \
             if model_path is not None \
             else osp.join(MODEL_DIR, 'english-caseless-left3words-distsim.tagger')
+        self._backend = backend
+        self._backend_options = backend_options
 
         super().__init__()
 
     def create_processor(self):
         jar = self._jar_path
         model = self._model_path
+        if self._backend == 'server':
+            return TaggerServer.pos(jar, model, **self._backend_options)
+        if self._backend is not None and self._backend != 'nltk':
+            return self._backend
+        from nltk.tag.stanford import StanfordPOSTagger
         return StanfordPOSTagger(model, path_to_jar=jar)
 
+    def config(self):
+        return self._jar_path, self._model_path
+
     def process(self, words, merge_nn=True):
-        tagger = self.processor
+        res_pos = self.processor.tag(words)
+
+        if merge_nn and len(res_pos) > 0:
+            tokens, tags = zip(*res_pos)
+            tokens, tags, _ = self.merge_nouns(tokens, tags, np.zeros(len(tokens), dtype=np.int64))
+            res_pos = list(zip(tokens, tags))
+
+        return res_pos
 
-        res_pos = tagger.tag(words)
+    def process_batch(self, sentences, merge_nn=True):
+        # tags many token lists in one backend call
+        # returns parallel arrays of tokens, tags and the position in
+        # sentences of the sentence of each token, noun runs merged if
+        # merge_nn is set
+
+        sentences = [list(words) for words in sentences]
+        ids = [i for i, words in enumerate(sentences) if len(words) > 0]
+        tagged = self.processor.tag_sents([sentences[i] for i in ids]) if len(ids) > 0 else []
+
+        tokens = np.array([w for t in tagged for w, _ in t], dtype=object)
+        tags = np.array([tag for t in tagged for _, tag in t], dtype=object)
+        sent_ids = np.repeat(np.array(ids, dtype=np.int64), [len(t) for t in tagged])
 
         if merge_nn:
+            return self.merge_nouns(tokens, tags, sent_ids)
+
+        return tokens, tags, sent_ids
 
-            def merge_nn(tg):
-                word = ' '.join([t[0] for t in tg])
-                pos = tg[-1][1]
-                return word, pos
+    @staticmethod
+    def merge_nouns(tokens, tags, sent_ids):
+        # merges runs of consecutive NN* tags of a sentence into one space
+        # joined token with the tag of the last token of the run
+        # tokens, tags, sent_ids: parallel arrays of a flat token stream
+        # returns the merged parallel arrays
 
-            res = []
-            cur_tagged = []
-            for tagged in res_pos:
-                if tagged[1].startswith('NN'):
-                    cur_tagged.append(tagged)
-                else:
-                    if len(cur_tagged) > 0:
-                        res.append(merge_nn(cur_tagged))
-                        cur_tagged = []
-                    res.append(tagged)
+        tokens = np.asarray(tokens, dtype=object)
+        tags = np.asarray(tags, dtype=object)
+        sent_ids = np.asarray(sent_ids)
 
-            if len(cur_tagged) > 0:
-                res.append(merge_nn(cur_tagged))
+        if len(tokens) == 0:
+            return tokens, tags, sent_ids
 
-            res_pos = res
+        is_nn = np.char.startswith(tags.astype(str), 'NN')
 
-        return res_pos
+        # tokens continuing the run of the previous token
+        cont = np.zeros(len(tokens), dtype=bool)
+        cont[1:] = is_nn[1:] & is_nn[:-1] & (sent_ids[1:] == sent_ids[:-1])
+
+        starts = np.flatnonzero(~cont)
+        ends = np.append(starts[1:], len(tokens)) - 1
+
+        pieces = tokens.copy()
+        pieces[cont] = ' ' + tokens[cont]
+        merged = np.add.reduceat(pieces, starts)
+
+        return merged, tags[ends], sent_ids[starts]
 
 
 class SVOStanford(Processor):
+    # ner: NERStanford used when use_ner is set, default the one of this process
+
+    def __init__(self, ner=None):
+        self._ner = ner
+
+        super().__init__()
+
+    @property
+    def ner(self):
+        return self._ner if self._ner is not None else get_processor('ner')
 
     def create_processor(self):
+        from openie import StanfordOpenIE
         return StanfordOpenIE()
 
     def annotate(self, text):
         return self.processor.annotate(text)
 
+    def annotate_batch(self, texts):
+        # openie triples of many texts with one request
+        # every text is annotated as a single sentence on its own line
+        # returns list of triple lists, in the order of texts
+
+        texts = [' '.join(t.split()) for t in texts]
+
+        starts = []
+        offset = 0
+        for t in texts:
+            starts.append(offset)
+            offset = offset + len(t) + 1
+
+        output = self.processor.annotate('\n'.join(texts),
+                                         properties={'ssplit.eolonly': 'true'},
+                                         simple_format=False)
+
+        res = [[] for _ in texts]
+        for sentence in output['sentences']:
+            if len(sentence['tokens']) == 0:
+                continue
+            # sentences of empty lines are missing, match them by offset
+            line = bisect.bisect_right(starts, sentence['tokens'][0]['characterOffsetBegin']) - 1
+            res[line].extend({'subject': triple['subject'],
+                              'relation': triple['relation'],
+                              'object': triple['object']} for triple in sentence['openie'])
+
+        return res
+
+    def _first_org(self, svo_list, orgs):
+        # first triple whose subject has an organization, with it as subject
+
+        for svo in svo_list:
+            org = orgs.get(svo['subject'])
+            if org is not None:
+                return org, svo['relation'], svo['object']
+
+        return None, None, None
+
+    def _subject_orgs(self, subjects):
+        # organization of each unique subject, tagged in one batch
+
+        ner = self.ner
+        subjects = list(dict.fromkeys(subjects))
+        tagged = ner.process_batch([to_words(s) for s in subjects])
+
+        return {s: ner.first_ne(words_ner, key="ORGANIZATION")
+                for s, words_ner in zip(subjects, tagged)}
+
+    @memoize('svo', key=lambda self, text, use_ner=False:
+             (self.config(), text, use_ner, self.ner.cache_key() if use_ner else None))
     def process(self, text, use_ner=False):
 
         svo_list = self.annotate(text)
@@ -134,31 +271,55 @@ class SVOStanford(Processor):
                                    'v': svo['relation'],
                                    'o': svo['object']})
 
-        for svo in svo_list:
-            words = self.txtp.to_words(svo['subject'])
-            words_ner = self.tokp.tag_ner(words)
-            org = self.tokp.first_ne(words_ner, key="ORGANIZATION")
+        orgs = self._subject_orgs([svo['subject'] for svo in svo_list])
+        s, v, o = self._first_org(svo_list, orgs)
 
-            if org is not None:
-                return pd.Series(data={'s': org,
-                                       'v': svo['relation'],
-                                       'o': svo['object']})
+        return pd.Series(data={'s': s, 'v': v, 'o': o})
+
+    def process_batch(self, texts, use_ner=False, batch_size=100):
+        # process for many texts, e.g. a list or series of titles
+        # texts are annotated batch_size per request, with use_ner the
+        # subjects of all triples of a batch are tagged in one ner call
+        # returns dataframe with columns s, v, o and the index of texts
+
+        index = texts.index if isinstance(texts, pd.Series) else None
+        texts = list(texts)
+
+        rows = []
+        for start in range(0, len(texts), batch_size):
+            svo_lists = self.annotate_batch(texts[start:start + batch_size])
+
+            if use_ner:
+                orgs = self._subject_orgs(svo['subject'] for svo_list in svo_lists for svo in svo_list)
+                rows.extend(self._first_org(svo_list, orgs) for svo_list in svo_lists)
+            else:
+                rows.extend((svo_list[0]['subject'], svo_list[0]['relation'], svo_list[0]['object'])
+                            if len(svo_list) > 0 else (None, None, None)
+                            for svo_list in svo_lists)
 
-        return pd.Series(data={'s': None, 'v': None, 'o': None})
+        return pd.DataFrame(rows, columns=['s', 'v', 'o'], index=index)
 
 
 class WordVector(Processor):
+    # mmap='r' maps the vectors of models written by convert_gensim_model
+    # read only, None loads them into memory
 
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, mmap='r'):
         self._model_path = model_path \
             if model_path is not None \
             else osp.join(MODEL_DIR, 'wv_100000.model')
+        self._mmap = mmap
 
         super().__init__()
 
     def create_processor(self):
-        return gensim.models.KeyedVectors.load(self._model_path)
+        import gensim
+        return gensim.models.KeyedVectors.load(self._model_path, mmap=self._mmap)
 
+    def config(self):
+        return self._model_path,
+
+    @memoize('word_vector', key=lambda self, text: (self.config(), text))
     def process(self, text):
 
         words = to_words(text.lower())
@@ -175,30 +336,113 @@ class WordVector(Processor):
 
         return sum / count
 
+    def process_batch(self, texts, batch_size=10000):
+        # average word vectors of many texts, e.g. a list or series
+        # returns float32 matrix with one row per text, and a boolean mask of
+        # rows with at least one known word, the other rows are 0
+        # texts are embedded batch_size at a time to bound memory
 
-class Lemmatizer(Processor):
+        kv = self.processor
+        key_to_index = kv.key_to_index
+        texts = list(texts)
 
-    def create_processor(self):
-        return WordNetLemmatizer()
+        res = np.zeros((len(texts), kv.vector_size), dtype=np.float32)
+        counts = np.zeros(len(texts), dtype=np.int64)
+
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+
+            index = []
+            rows = []
+            for i, text in enumerate(batch):
+                for w in to_words(text.lower()):
+                    j = key_to_index.get(w)
+                    if j is not None:
+                        index.append(j)
+                        rows.append(i)
+
+            if len(index) == 0:
+                continue
+
+            batch_counts = np.bincount(rows, minlength=len(batch))
+            found = batch_counts > 0
+            # rows are ascending, so each text is a contiguous run of vectors
+            offsets = np.concatenate([[0], np.cumsum(batch_counts)[:-1]])
+            sums = np.add.reduceat(kv.vectors[np.asarray(index)], offsets[found], axis=0)
+
+            res[start:start + len(batch)][found] = sums / batch_counts[found, None]
+            counts[start:start + len(batch)] = batch_counts
+
+        return res, counts > 0
+
+
+class TokenProcessor(Processor):
+    # processor of single tokens, keeps a bounded per process cache of results
+    # cache_size: max number of cached tokens, the oldest are dropped first,
+    #   0 disables the cache
+    # vocab: dict of token to result, or file written by save_vocab, to preload
+
+    def __init__(self, cache_size=100000, vocab=None):
+        self._tokens = BoundedDict(cache_size)
+
+        super().__init__()
+
+        if vocab is not None:
+            self.load_vocab(vocab)
+
+    def process_token(self, word):
+        raise ValueError("process_token function is not defined")
 
     def process(self, word):
 
         if isinstance(word, list):
             return [self.process(w) for w in word]
 
-        return self.processor.lemmatize(word.lower())
+        res = self._tokens.get(word)
+        if res is None:
+            res = self.process_token(word)
+            self._tokens.set(word, res)
+
+        return res
+
+    def process_batch(self, words):
+        # processes each unique token once and maps the results back
+
+        unique = dict.fromkeys(words)
+        for w in unique:
+            unique[w] = self.process(w)
+
+        return [unique[w] for w in words]
+
+    def load_vocab(self, vocab):
+
+        if isinstance(vocab, str):
+            vocab = read_pickle(vocab)
 
+        for word, res in vocab.items():
+            self._tokens.set(word, res)
 
-class Stemmer(Processor):
+    def save_vocab(self, file):
+        write_pickle(dict(self._tokens.items()), file)
+
+
+class Lemmatizer(TokenProcessor):
 
     def create_processor(self):
-        return PorterStemmer()
+        from nltk.stem import WordNetLemmatizer
+        return WordNetLemmatizer()
 
-    def process(self, word):
+    def process_token(self, word):
+        return self.processor.lemmatize(word.lower())
 
-        if isinstance(word, list):
-            return [self.process(w) for w in word]
 
+class Stemmer(TokenProcessor):
+
+    def create_processor(self):
+        from nltk.stem import PorterStemmer
+        return PorterStemmer()
+
+    def process_token(self, word):
         return self.processor.stem(word)
 
 
@@ -211,7 +455,14 @@ class StopWords(Processor):
 
     def create_processor(self):
 
-        return self._stop_words if self._stop_words is not None else set(stopwords.words('english'))
+        if self._stop_words is not None:
+            return self._stop_words
+
+        from nltk.corpus import stopwords
+        return set(stopwords.words('english'))
+
+    def config(self):
+        return tuple(sorted(self._stop_words)) if self._stop_words is not None else ()
 
     def process(self, words):
         stop_words = self.processor
@@ -223,3 +474,53 @@ class StopWords(Processor):
                 res.append(w)
 
         return res
+
+
+# named processors, created at most once per process by get_processor
+PROCESSORS = {
+    'ner': NERStanford,
+    'pos': POSStanford,
+    'svo': SVOStanford,
+    'word_vector': WordVector,
+    'lemmatizer': Lemmatizer,
+    'stemmer': Stemmer,
+    'stop_words': StopWords,
+}
+
+_instances = {}
+
+
+def register_processor(name, factory):
+    # registers a factory for a named processor
+    # factory is called without arguments, e.g. a Processor subclass
+    # registering the factory already registered keeps its instance
+
+    if PROCESSORS.get(name) is factory:
+        return
+
+    PROCESSORS[name] = factory
+    _instances.pop(name, None)
+
+
+def get_processor(name):
+    # returns the named processor of this process, creating it on first use
+
+    if name not in _instances:
+        _instances[name] = PROCESSORS[name]()
+
+    return _instances[name]
+
+
+def init_processors(processors, load=True):
+    # creates named processors for this process, e.g. in a worker initializer
+    # processors: list of names, or dict of name to factory to register
+    # load: also create the underlying models now instead of on first use
+
+    if isinstance(processors, dict):
+        for name, factory in processors.items():
+            register_processor(name, factory)
+
+    for name in processors:
+        processor = get_processor(name)
+        if load:
+            processor.processor
@@ -0,0 +1,223 @@
+import atexit
+import os
+import os.path as osp
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _java():
+    java_home = os.environ.get('JAVAHOME')
+    return osp.join(java_home, 'bin', 'java') if java_home is not None else 'java'
+
+
+def _free_port():
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# runs a server command and stops it when its stdin is closed, which also
+# happens when the process holding the other end exits without cleanup,
+# e.g. pool workers leaving through os._exit or killed
+_WATCHDOG = """
+import signal, subprocess, sys, threading
+proc = subprocess.Popen(sys.argv[1:], stdin=subprocess.DEVNULL)
+def stop(*args):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    sys.exit(0)
+def watch():
+    sys.stdin.buffer.read()
+    stop()
+signal.signal(signal.SIGTERM, stop)
+threading.Thread(target=watch, daemon=True).start()
+sys.exit(proc.wait())
+"""
+
+
+class TaggerServer:
+    # long lived tagger backend, keeps one or more tagging server processes
+    # running and sends them one sentence per local socket connection
+    # has the tag/tag_sents interface of the nltk stanford taggers
+    # command: server command line, '-port <port>' is appended
+    # separator: separator of word and tag in the server output
+    # processes: number of server processes, sentences are spread over them
+    # connections: number of concurrent requests of tag_sents
+    # servers started by a process are stopped when it exits, also without
+    # atexit, e.g. in pool workers, forked workers reuse the servers of
+    # their parent
+
+    def __init__(self,
+                 command,
+                 separator,
+                 processes=1,
+                 connections=4,
+                 encoding='utf8',
+                 startup_timeout=120,
+                 timeout=60):
+        self.command = list(command)
+        self.separator = separator
+        self.connections = connections
+        self.encoding = encoding
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._procs = []
+        self.ports = []
+
+        for _ in range(processes):
+            port = _free_port()
+            proc = subprocess.Popen([sys.executable, '-c', _WATCHDOG] + self.command + ['-port', str(port)],
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+            self._procs.append(proc)
+            self.ports.append(port)
+
+        atexit.register(self.close)
+
+        for proc, port in zip(self._procs, self.ports):
+            self._wait(proc, port, startup_timeout)
+
+    @classmethod
+    def ner(cls, jar_path, model_path, memory='1000m', **kwargs):
+        # stanford ner server, tokens are sent whitespace separated
+
+        command = [_java(), f'-mx{memory}', '-cp', jar_path,
+                   'edu.stanford.nlp.ie.NERServer',
+                   '-loadClassifier', model_path,
+                   '-outputFormat', 'slashTags',
+                   '-tokenizerFactory', 'edu.stanford.nlp.process.WhitespaceTokenizer',
+                   '-tokenizerOptions', 'tokenizeNLs=false',
+                   '-encoding', 'utf8']
+
+        return cls(command, separator='/', **kwargs)
+
+    @classmethod
+    def pos(cls, jar_path, model_path, memory='1000m', **kwargs):
+        # stanford pos tagger server, tokens are sent whitespace separated
+
+        command = [_java(), f'-mx{memory}', '-cp', jar_path,
+                   'edu.stanford.nlp.tagger.maxent.MaxentTaggerServer',
+                   '-model', model_path,
+                   '-tokenize', 'false',
+                   '-encoding', 'utf8']
+
+        return cls(command, separator='_', **kwargs)
+
+    def __getstate__(self):
+        # the server processes stay with the process that started them
+        state = self.__dict__.copy()
+        state['_procs'] = []
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _wait(proc, port, timeout):
+
+        start = time.time()
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"tagger server exited with code {proc.returncode}")
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    return
+            except OSError:
+                if time.time() - start > timeout:
+                    raise RuntimeError(f"tagger server not ready on port {port}")
+                time.sleep(0.1)
+
+    def _port(self):
+
+        with self._lock:
+            port = self.ports[self._next % len(self.ports)]
+            self._next = self._next + 1
+
+        return port
+
+    def _request(self, line):
+
+        with socket.create_connection(('127.0.0.1', self._port()), timeout=self.timeout) as sock:
+            sock.sendall((line + '\n').encode(self.encoding))
+            sock.shutdown(socket.SHUT_WR)
+
+            chunks = []
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+
+        return b''.join(chunks).decode(self.encoding)
+
+    def tag(self, words):
+
+        words = list(words)
+        if len(words) == 0:
+            return []
+
+        tokens = self._request(' '.join(words)).split()
+        tags = [t.rsplit(self.separator, 1)[-1] for t in tokens]
+
+        if len(tags) != len(words):
+            # server split or merged tokens, keep its words
+            return [tuple(t.rsplit(self.separator, 1)) for t in tokens]
+
+        return list(zip(words, tags))
+
+    def tag_sents(self, sentences):
+
+        with ThreadPoolExecutor(self.connections) as executor:
+            return list(executor.map(self.tag, sentences))
+
+    def close(self):
+
+        for proc in self._procs:
+            if proc.poll() is None:
+                # the watchdog stops the server on end of input or sigterm
+                proc.stdin.close()
+                proc.terminate()
+                try:
+                    proc.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+        self._procs = []
+
+
+class FakeTagger:
+    # in process tagger backend for tests, with the tag/tag_sents interface
+    # tags: dict of word to tag, other words get default
+    # func: func(word) returning the tag, used instead of tags if given
+    # calls counts backend calls
+
+    def __init__(self, tags=None, default='O', func=None):
+        self.tags = tags if tags is not None else {}
+        self.default = default
+        self.func = func
+        self.calls = 0
+
+    def _tag(self, word):
+        if self.func is not None:
+            return self.func(word)
+        return self.tags.get(word, self.default)
+
+    def tag(self, words):
+        return self.tag_sents([words])[0]
+
+    def tag_sents(self, sentences):
+        self.calls = self.calls + 1
+        return [[(w, self._tag(w)) for w in words] for words in sentences]
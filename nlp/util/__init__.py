@@ -1,2 +1,6 @@
 from .common import *
-from .task import *
\ No newline at end of file
+from .clean import *
+from .task import *
+from .lang import *
+from .cluster import *
+from .index import *
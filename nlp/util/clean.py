@@ -0,0 +1,68 @@
+import string
+
+from andromeda.nlp.util.common import to_words, to_sentence
+
+
+class TextCleaner:
+    # clean_words pipeline configured once
+    # removes punctuation, tokenizes, then removes digits, lemmatizes and
+    # filters stop words in a single pass over the tokens of a document
+    # lemmatizer, stop_words: processors, default the ones of this process
+
+    def __init__(self, lemmatizer=None, stop_words=None):
+        self._lemmatizer = lemmatizer
+        self._stop_words = stop_words
+        self._punctuations = str.maketrans('', '', string.punctuation)
+        self._digits = str.maketrans('', '', string.digits)
+
+    @property
+    def lemmatizer(self):
+        if self._lemmatizer is None:
+            from andromeda.nlp.processor import get_processor
+            return get_processor('lemmatizer')
+        return self._lemmatizer
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            from andromeda.nlp.processor import get_processor
+            return get_processor('stop_words')
+        return self._stop_words
+
+    def clean_words(self, text):
+
+        lm = self.lemmatizer
+        stop_words = self.stop_words.processor
+        digits = self._digits
+
+        words = []
+        for w in to_words(text.translate(self._punctuations)):
+            w = lm.process(w.translate(digits))
+            if w.lower() not in stop_words:
+                words.append(w)
+
+        return words
+
+    def clean_sentence(self, text):
+        return to_sentence(self.clean_words(text))
+
+    def clean_many(self, texts, tokens=False):
+        # cleans a list of texts, each unique text once
+
+        clean = self.clean_words if tokens else self.clean_sentence
+
+        unique = dict.fromkeys(texts)
+        for text in unique:
+            unique[text] = clean(text)
+
+        return [unique[text] for text in texts]
+
+    def clean_batch(self, texts, tokens=False, num_workers=None, chunk=10000):
+        # cleans a list or series of texts
+        # returns cleaned strings, or token lists if tokens is set,
+        # as a list, or a series with the index of texts
+        # num_workers: clean chunks of texts in a process pool
+
+        from andromeda.util import map_chunks
+
+        return map_chunks(self.clean_many, texts, num_workers=num_workers, chunk=chunk, tokens=tokens)
@@ -0,0 +1,101 @@
+import numpy as np
+from andromeda.util import read_array, read_pickle, write_pickle
+
+
+class StreamingKMeans:
+    # mini batch kmeans over matrices larger than memory
+    # fit streams row batches of a matrix, e.g. a .npy file written by
+    # write_array and memory mapped, partial_fit updates the centroids with
+    # new vectors, and predict assigns vectors to the current centroids
+    # without a refit
+    # batch_size: rows read and fitted at a time
+    # kwargs: passed to sklearn MiniBatchKMeans
+
+    def __init__(self, n_clusters, batch_size=10000, random_state=0, **kwargs):
+        from sklearn.cluster import MiniBatchKMeans
+
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        kwargs.setdefault('n_init', 1)
+        self.model = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, **kwargs)
+        self.n_seen = 0
+        self._pending = None
+
+    @property
+    def cluster_centers_(self):
+        return self.model.cluster_centers_
+
+    @property
+    def fitted(self):
+        return hasattr(self.model, 'cluster_centers_')
+
+    def _batches(self, matrix, mask=None):
+        # float32 row batches of matrix with rows of mask set
+        # matrix: array, or file of write_array, memory mapped
+
+        if isinstance(matrix, str):
+            matrix = read_array(matrix, mmap=True)
+
+        for start in range(0, len(matrix), self.batch_size):
+            stop = start + self.batch_size
+            batch = np.asarray(matrix[start:stop], dtype=np.float32)
+            if mask is not None:
+                batch = batch[np.asarray(mask[start:stop], dtype=bool)]
+            yield batch
+
+    def partial_fit(self, vectors, mask=None):
+        # updates the centroids with vectors, e.g. of newly ingested articles
+        # vectors are held back until there are n_clusters of them for the
+        # first update
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if mask is not None:
+            vectors = vectors[np.asarray(mask, dtype=bool)]
+
+        if self._pending is not None:
+            vectors = np.concatenate([self._pending, vectors])
+            self._pending = None
+
+        if not self.fitted and len(vectors) < self.n_clusters:
+            self._pending = vectors
+            return self
+
+        if len(vectors) > 0:
+            self.model.partial_fit(vectors)
+            self.n_seen = self.n_seen + len(vectors)
+
+        return self
+
+    def fit(self, matrix, mask=None, epochs=1):
+        # fits the centroids on all rows of matrix, batch_size rows at a time
+
+        for _ in range(epochs):
+            for batch in self._batches(matrix, mask):
+                self.partial_fit(batch)
+
+        if not self.fitted:
+            raise ValueError(f"need at least {self.n_clusters} vectors to fit, "
+                             f"got {0 if self._pending is None else len(self._pending)}")
+
+        return self
+
+    def predict(self, matrix, mask=None):
+        # cluster of each row of matrix, -1 for rows not set in mask
+
+        if not self.fitted:
+            raise ValueError("model is not fitted")
+
+        res = [self.model.predict(batch) for batch in self._batches(matrix)]
+        res = np.concatenate(res).astype(np.int32) if len(res) > 0 else np.zeros(0, dtype=np.int32)
+
+        if mask is not None:
+            res[~np.asarray(mask, dtype=bool)] = -1
+
+        return res
+
+    def save(self, file):
+        write_pickle(self, file)
+
+    @staticmethod
+    def load(file):
+        return read_pickle(file)
@@ -1,7 +1,7 @@
 import string
-from nltk.tokenize import word_tokenize, sent_tokenize
-from sklearn.cluster import KMeans
-from langdetect import detect_langs
+
+# nltk, sklearn and langdetect are imported by the functions using them,
+# so importing andromeda.nlp.util stays fast
 
 
 def clean_symbols(text, symbols):
@@ -21,10 +21,12 @@ def clean_digits(text):
 
 
 def to_words(text):
+    from nltk.tokenize import word_tokenize
     return word_tokenize(text)
 
 
 def parse_sentences(text):
+    from nltk.tokenize import sent_tokenize
     return sent_tokenize(text)
 
 
@@ -48,6 +50,8 @@ def to_sentence(words):
 
 
 def kmean(n_clusters, train_data):
+    from sklearn.cluster import KMeans
+
     km = KMeans(n_clusters=n_clusters)
     km.fit(train_data)
 
@@ -58,6 +62,8 @@ def is_english(title):
     # checks if article is english
     # not very accuracy given short titles
 
+    from langdetect import detect_langs
+
     res = detect_langs(title.lower())
 
     for r in res:
@@ -0,0 +1,237 @@
+import os.path as osp
+
+import numpy as np
+from andromeda.util import read_array, write_array, read_pickle, write_pickle
+
+
+def _normalize(vectors):
+    # float32 unit rows, zero rows stay zero
+
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+    return vectors
+
+
+class VectorIndex:
+    # inverted file index for top k cosine similarity queries over
+    # embeddings, e.g. the WordVector matrix of titles or svo columns
+    # vectors are split into n_lists lists by kmeans centroids, a query only
+    # scans the rows of the n_probe lists with the closest centroids
+    # rows added after build are kept aside and scanned by every query until
+    # there are compact_size of them, then they are merged into the lists
+    # keys: int ids of the vectors, default their position in insertion order
+    # save writes a directory of .npy files, load memory maps them
+
+    def __init__(self, n_lists=None, n_probe=8, compact_size=10000, random_state=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.compact_size = compact_size
+        self.random_state = random_state
+
+        self.centroids = None
+        self.vectors = None
+        self.keys = None
+        self.offsets = None
+
+        self._extra_vectors = []
+        self._extra_keys = []
+        self._next_key = 0
+
+    def __len__(self):
+        return (0 if self.keys is None else len(self.keys)) + sum(len(k) for k in self._extra_keys)
+
+    def _keys(self, n, keys):
+
+        if keys is None:
+            keys = np.arange(self._next_key, self._next_key + n, dtype=np.int64)
+        keys = np.asarray(keys, dtype=np.int64)
+
+        if len(keys) > 0:
+            self._next_key = max(self._next_key, int(keys.max()) + 1)
+
+        return keys
+
+    def _assign(self, vectors):
+        # closest centroid of each row
+
+        lists = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 100000):
+            batch = vectors[start:start + 100000]
+            lists[start:start + 100000] = np.argmax(batch @ self.centroids.T, axis=1)
+
+        return lists
+
+    def _layout(self, vectors, keys):
+        # rows sorted by list, rows of list i are offsets[i]:offsets[i + 1]
+
+        lists = self._assign(vectors)
+        order = np.argsort(lists, kind='stable')
+
+        self.vectors = vectors[order]
+        self.keys = keys[order]
+        self.offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+
+    def build(self, vectors, keys=None, mask=None, sample_size=100000):
+        # builds the index from a matrix of vectors
+        # mask: only index rows set in mask, e.g. of WordVector.process_batch
+        # sample_size: rows the centroids are trained on
+
+        from andromeda.nlp.util.cluster import StreamingKMeans
+
+        vectors = _normalize(vectors)
+        keys = self._keys(len(vectors), keys)
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            vectors, keys = vectors[mask], keys[mask]
+
+        if len(vectors) == 0:
+            raise ValueError("no vectors to index")
+
+        n_lists = self.n_lists if self.n_lists is not None else int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        rng = np.random.default_rng(self.random_state)
+        sample = vectors[np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))]
+        km = StreamingKMeans(n_lists, random_state=self.random_state).fit(sample)
+
+        self.centroids = _normalize(km.cluster_centers_)
+        self._extra_vectors = []
+        self._extra_keys = []
+        self._layout(vectors, keys)
+
+        return self
+
+    def add(self, vectors, keys=None, mask=None):
+        # adds vectors to a built index without retraining the centroids
+        # returns the keys of the added vectors
+
+        if self.centroids is None:
+            raise ValueError("index is not built")
+
+        vectors = _normalize(vectors)
+        keys = self._keys(len(vectors), keys)
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            vectors, keys = vectors[mask], keys[mask]
+
+        self._extra_vectors.append(vectors)
+        self._extra_keys.append(keys)
+
+        if sum(len(k) for k in self._extra_keys) >= self.compact_size:
+            self.compact()
+
+        return keys
+
+    def compact(self):
+        # merges added vectors into the lists
+
+        if len(self._extra_keys) == 0:
+            return
+
+        vectors = np.concatenate([self.vectors] + self._extra_vectors)
+        keys = np.concatenate([self.keys] + self._extra_keys)
+
+        self._extra_vectors = []
+        self._extra_keys = []
+        self._layout(vectors, keys)
+
+    @staticmethod
+    def _top(scores, keys, k):
+        # top k of scores, in decreasing order, padded with key -1
+
+        res_keys = np.full(k, -1, dtype=np.int64)
+        res_scores = np.full(k, -np.inf, dtype=np.float32)
+
+        n = min(k, len(scores))
+        if n > 0:
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            res_keys[:n] = keys[top]
+            res_scores[:n] = scores[top]
+
+        return res_keys, res_scores
+
+    def search(self, queries, k=10, n_probe=None):
+        # top k most cosine similar vectors of each query
+        # queries: a vector, or a matrix of one query per row
+        # returns keys and similarities, of shape (len(queries), k), or (k,)
+        # for a single vector, missing results have key -1
+
+        if self.centroids is None:
+            raise ValueError("index is not built")
+
+        single = np.ndim(queries) == 1
+        queries = _normalize(queries)
+        n_probe = min(n_probe if n_probe is not None else self.n_probe, len(self.centroids))
+
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        extra_vectors = np.concatenate(self._extra_vectors) if len(self._extra_vectors) > 0 else None
+        extra_keys = np.concatenate(self._extra_keys) if len(self._extra_keys) > 0 else None
+
+        res_keys = np.empty((len(queries), k), dtype=np.int64)
+        res_scores = np.empty((len(queries), k), dtype=np.float32)
+        for i, (query, lists) in enumerate(zip(queries, probes)):
+            scores = [self.vectors[self.offsets[j]:self.offsets[j + 1]] @ query for j in lists]
+            keys = [self.keys[self.offsets[j]:self.offsets[j + 1]] for j in lists]
+            if extra_vectors is not None:
+                scores.append(extra_vectors @ query)
+                keys.append(extra_keys)
+
+            res_keys[i], res_scores[i] = self._top(np.concatenate(scores), np.concatenate(keys), k)
+
+        if single:
+            return res_keys[0], res_scores[0]
+
+        return res_keys, res_scores
+
+    def search_texts(self, texts, k=10, n_probe=None, wv=None):
+        # search with the word vector averages of texts, e.g. seed phrases
+        # texts without known words get no results
+        # wv: WordVector processor, default the one of this process
+
+        if wv is None:
+            from andromeda.nlp.processor import get_processor
+            wv = get_processor('word_vector')
+
+        vectors, mask = wv.process_batch(list(texts))
+        res_keys, res_scores = self.search(vectors, k=k, n_probe=n_probe)
+        res_keys[~mask] = -1
+        res_scores[~mask] = -np.inf
+
+        return res_keys, res_scores
+
+    def save(self, path):
+        # writes the index to directory path
+
+        self.compact()
+
+        write_array(self.centroids, osp.join(path, 'centroids.npy'))
+        write_array(self.vectors, osp.join(path, 'vectors.npy'))
+        write_array(self.keys, osp.join(path, 'keys.npy'))
+        write_array(self.offsets, osp.join(path, 'offsets.npy'))
+        write_pickle({'n_lists': self.n_lists,
+                      'n_probe': self.n_probe,
+                      'compact_size': self.compact_size,
+                      'random_state': self.random_state,
+                      'next_key': self._next_key}, osp.join(path, 'index.pkl'))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # reads an index written by save, vectors memory mapped if mmap is set
+
+        meta = read_pickle(osp.join(path, 'index.pkl'))
+        index = cls(n_lists=meta['n_lists'],
+                    n_probe=meta['n_probe'],
+                    compact_size=meta['compact_size'],
+                    random_state=meta['random_state'])
+
+        index.centroids = read_array(osp.join(path, 'centroids.npy'), mmap=False)
+        index.vectors = read_array(osp.join(path, 'vectors.npy'), mmap=mmap)
+        index.keys = read_array(osp.join(path, 'keys.npy'), mmap=mmap)
+        index.offsets = read_array(osp.join(path, 'offsets.npy'), mmap=False)
+        index._next_key = meta['next_key']
+
+        return index
@@ -0,0 +1,127 @@
+import string
+
+from andromeda.util.cache import BoundedDict
+
+
+_missing = object()
+
+
+class LanguageFilter:
+    # language check of documents, configured once and reused
+    # detection runs on the first sample_size characters of the lower cased
+    # text with collapsed whitespace, seeded so a text always gets the same
+    # answer
+    # texts with at least min_words words and stop_ratio of them english stop
+    # words are english without running the detector, None disables the check
+    # stop_words: set of english stop words, default the stop_words processor
+    # cache_size: max number of cached samples, the oldest are dropped first,
+    #   0 disables the cache
+    # results are True, False, or None when the language can not be detected
+
+    def __init__(self,
+                 lang='en',
+                 sample_size=2000,
+                 seed=0,
+                 stop_ratio=0.25,
+                 min_words=8,
+                 stop_words=None,
+                 cache_size=100000):
+        self.lang = lang
+        self.sample_size = sample_size
+        self.seed = seed
+        self.stop_ratio = stop_ratio
+        self.min_words = min_words
+        self.cache_size = cache_size
+        self._stop_words = set(stop_words) if stop_words is not None else None
+        self._punctuations = str.maketrans('', '', string.punctuation)
+        self._results = BoundedDict(cache_size)
+
+    @property
+    def stop_words(self):
+        if self._stop_words is None:
+            from andromeda.nlp.processor import get_processor
+            self._stop_words = get_processor('stop_words').processor
+        return self._stop_words
+
+    def sample(self, text):
+        # normalized text the check runs on
+
+        if self.sample_size is not None:
+            # a little extra so the whitespace split does not cut the last word
+            text = text[:self.sample_size + 100]
+
+        text = ' '.join(text.lower().split())
+
+        return text[:self.sample_size] if self.sample_size is not None else text
+
+    def stop_word_ratio(self, sample):
+        # share of english stop words in the words of sample, None if too short
+
+        words = sample.translate(self._punctuations).split()
+        if len(words) < max(self.min_words, 1):
+            return None
+
+        stop_words = self.stop_words
+        return sum(w in stop_words for w in words) / len(words)
+
+    def languages(self, sample):
+        # list of (language, probability) of sample, None if not detectable
+
+        from langdetect import detector_factory
+        from langdetect.lang_detect_exception import LangDetectException
+
+        detector_factory.init_factory()
+        detector = detector_factory._factory.create()
+        detector.seed = self.seed
+        detector.append(sample)
+
+        try:
+            return [(r.lang, r.prob) for r in detector.get_probabilities()]
+        except LangDetectException:
+            return None
+
+    def _check(self, sample):
+
+        if self.stop_ratio is not None and self.lang == 'en':
+            ratio = self.stop_word_ratio(sample)
+            if ratio is not None and ratio >= self.stop_ratio:
+                return True
+
+        res = self.languages(sample)
+        if res is None:
+            return None
+
+        return any(lang == self.lang for lang, _ in res)
+
+    def _check_cached(self, sample):
+
+        res = self._results.get(sample, _missing)
+        if res is _missing:
+            res = self._check(sample)
+            self._results.set(sample, res)
+
+        return res
+
+    def check(self, text):
+        return self._check_cached(self.sample(text))
+
+    def check_many(self, texts):
+        # checks a list of texts, each unique sample once
+
+        samples = [self.sample(t) for t in texts]
+
+        unique = dict.fromkeys(samples)
+        for sample in unique:
+            unique[sample] = self._check_cached(sample)
+
+        return [unique[s] for s in samples]
+
+    def check_batch(self, texts, num_workers=None, chunk=10000):
+        # checks a list or series of texts
+        # returns True, False or None per text, as a list, or a series with
+        # the index of texts
+        # num_workers: check chunks of texts in a process pool
+
+        from andromeda.util import map_chunks
+
+        return map_chunks(self.check_many, texts, num_workers=num_workers, chunk=chunk)
@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+import numpy as np
 import pandas as pd
 from fuzzywuzzy import fuzz
 
@@ -15,25 +18,117 @@ def get_matches_fuzzy(ticker, tickers):
     return match
 
 
-def create_ticker_map(subjects, tickers):
+def _ngrams(text, n):
+    # set of character ngrams of text padded with a space at both ends, so
+    # texts shorter than n still have ngrams at their word boundaries
+    text = f' {text} '
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
 
-    ticker_map = {}
+
+class TickerMatcher:
+    # fuzzy matcher of subjects to tickers, built once from the security table
+    # tickers: list of (name, symbol), as for get_matches_fuzzy
+    # names are indexed by character ngrams, and only names sharing at least
+    # min_overlap of the ngrams of the shorter of subject and name are scored
+    # with fuzz.partial_ratio, min_overlap=0 scores every name like
+    # get_matches_fuzzy
+    # min_length: subjects and names shorter than min_length are always
+    #   scored, a few characters match many names by chance and their ngrams
+    #   can not tell which, e.g. 3M or GE
+    # aliases: dict of subject to list of symbols, returned without scoring
+    # results of subjects already matched are reused
+
+    def __init__(self, tickers, threshold=80, n=3, min_overlap=0.3, min_length=9, aliases=None):
+        self.tickers = list(tickers)
+        self.threshold = threshold
+        self.n = n
+        self.min_overlap = min_overlap
+        self.min_length = min_length
+        self.aliases = dict(aliases) if aliases is not None else {}
+        self._matches = {}
+
+        postings = defaultdict(list)
+        for i, (name, _) in enumerate(self.tickers):
+            for g in _ngrams(name, n):
+                postings[g].append(i)
+
+        self._postings = {g: np.array(ids, dtype=np.int64) for g, ids in postings.items()}
+        self._name_ngrams = np.array([len(_ngrams(name, n)) for name, _ in self.tickers])
+        self._short_names = np.array([len(name) < min_length for name, _ in self.tickers], dtype=bool)
+
+    def candidates(self, subject):
+        # positions of the names worth scoring for subject
+
+        if self.min_overlap <= 0 or len(subject) < self.min_length:
+            return np.arange(len(self.tickers))
+
+        grams = _ngrams(subject, self.n)
+        ids = [self._postings[g] for g in grams if g in self._postings]
+        if len(ids) == 0:
+            return np.arange(len(self.tickers))
+
+        shared = np.bincount(np.concatenate(ids), minlength=len(self.tickers))
+        required = self.min_overlap * np.minimum(self._name_ngrams, len(grams))
+
+        return np.nonzero(((shared > 0) & (shared >= required)) | self._short_names)[0]
+
+    def match(self, subject):
+        # list of (symbol, score) of the names matching subject, in ticker order
+
+        if subject in self.aliases:
+            return [(symbol, 100) for symbol in self.aliases[subject]]
+
+        if subject in self._matches:
+            return self._matches[subject]
+
+        res = []
+        for i in self.candidates(subject):
+            name, symbol = self.tickers[i]
+            score = fuzz.partial_ratio(name, subject)
+            if score > self.threshold:
+                res.append((symbol, score))
+
+        self._matches[subject] = res
+
+        return res
+
+    def match_batch(self, subjects):
+        # match for many subjects, each unique subject is scored once
+
+        unique = dict.fromkeys(subjects)
+        for subject in unique:
+            unique[subject] = self.match(subject)
+
+        return [unique[subject] for subject in subjects]
+
+    def add_alias(self, subject, symbols):
+        self.aliases[subject] = list(symbols)
+
+
+def create_ticker_map(subjects, tickers, matcher=None, scores=False):
+    # matcher: TickerMatcher to reuse, built from tickers if None
+    # scores: map to (symbol, score) pairs instead of symbols
+
+    if matcher is None:
+        matcher = TickerMatcher(tickers)
+
+    subjects = list(dict.fromkeys(subjects))
     total = len(subjects)
-    count = 0
+    print(f"processing {total} subjects")
+
+    ticker_map = {}
     success = 0
-    failure = 0
-    for subject in subjects:
-        count = count + 1
-        print(f"processing {count} out of {total}")
-        ticker_map[subject] = get_matches_fuzzy(subject, tickers)
+    for count, (subject, matches) in enumerate(zip(subjects, matcher.match_batch(subjects))):
+
+        ticker_map[subject] = matches if scores else [symbol for symbol, _ in matches]
 
-        if len(ticker_map[subject]) > 0:
+        if len(matches) > 0:
             success = success + 1
-        else:
-            failure = failure + 1
-        print(f"subject: {subject}, match: {ticker_map[subject]}")
 
-        print(f"stat success {success}, failure {failure}")
+        if (count + 1) % 1000 == 0:
+            print(f"processed {count + 1} out of {total}")
+
+    print(f"stat success {success}, failure {total - success}")
 
     return ticker_map
 
@@ -1,12 +1,26 @@
-import gensim
-from andromeda.nlp.util import to_words, clean_punctuations, clean_digits, to_sentence
+import numpy as np
+from andromeda.nlp.util import to_words, to_sentence
+from andromeda.nlp.util.clean import TextCleaner
+from andromeda.util.cache import memoize
 
 
+def _cache_key(processor, name):
+    # cache key of processor, default the named processor of this process,
+    # so results are not shared across processors registered under name
+
+    if processor is None:
+        from andromeda.nlp.processor import get_processor
+        processor = get_processor(name)
+
+    return processor.cache_key()
+
+
+@memoize('get_org', key=lambda title, ner=None: (_cache_key(ner, 'ner'), title))
 def get_org(title, ner=None):
 
     if ner is None:
-        from andromeda.nlp.processor import NERStanford
-        ner = NERStanford()
+        from andromeda.nlp.processor import get_processor
+        ner = get_processor('ner')
 
     words = to_words(title.upper())
     words_ner = ner.process(words)
@@ -14,37 +28,94 @@ def get_org(title, ner=None):
     return org
 
 
-def clean_words(sentence, lemmatizer=None, stop_words=None):
-    lm = lemmatizer
-    if lm is None:
-        from andromeda.nlp.processor import Lemmatizer
-        lm = Lemmatizer()
-    sw = stop_words
-    if sw is None:
-        from andromeda.nlp.processor import StopWords
-        sw = StopWords()
+def normalize_title(title):
+    # upper case title with collapsed whitespace, titles with the same
+    # normalized form get the same organization
+
+    return ' '.join(title.upper().split())
+
 
-    res = clean_punctuations(sentence)
+def get_org_batch(titles, ner=None, batch_size=1000):
+    # get_org for many titles, unique normalized titles are tagged
+    # batch_size at a time in one ner backend call each
+    # returns list of organizations (or None) in the order of titles
 
-    words = to_words(res)
-    words = clean_digits(words)
-    words = lm.process(words)
-    words = sw.process(words)
+    if ner is None:
+        from andromeda.nlp.processor import get_processor
+        ner = get_processor('ner')
+
+    titles = list(titles)
+    unique = list(dict.fromkeys(normalize_title(t) for t in titles))
+
+    orgs = {}
+    for start in range(0, len(unique), batch_size):
+        batch = unique[start:start + batch_size]
+        tagged = ner.process_batch([to_words(t) for t in batch])
+        for title, words_ner in zip(batch, tagged):
+            orgs[title] = ner.first_ne(words_ner, key="ORGANIZATION")
+
+    return [orgs[normalize_title(t)] for t in titles]
 
-    return words
 
+_cleaner = TextCleaner()
+
+
+def clean_words(sentence, lemmatizer=None, stop_words=None):
 
+    cleaner = _cleaner
+    if lemmatizer is not None or stop_words is not None:
+        cleaner = TextCleaner(lemmatizer, stop_words)
+
+    return cleaner.clean_words(sentence)
+
+
+@memoize('clean_sentence',
+         key=lambda sentence, lemmatizer=None, stop_words=None:
+         (_cache_key(lemmatizer, 'lemmatizer'), _cache_key(stop_words, 'stop_words'), sentence))
 def clean_sentence(sentence, lemmatizer=None, stop_words=None):
     words = clean_words(sentence, lemmatizer, stop_words)
 
     return to_sentence(words)
 
 
-def create_gensim_model(glove_file="glove.42B.300d.w2vformat.txt"):
-    model = gensim.models.KeyedVectors.load_word2vec_format(glove_file, limit=500000)
+def create_gensim_model(glove_file="glove.42B.300d.w2vformat.txt", limit=500000):
+    import gensim
+
+    model = gensim.models.KeyedVectors.load_word2vec_format(glove_file, limit=limit)
     return model
 
 
-def load_gensim_model(model_file="wv_100000.model"):
-    model = gensim.models.KeyedVectors.load(model_file)
+def convert_gensim_model(model, model_file="wv_100000.model", limit=None, words=None):
+    # one time conversion of word vectors to a model that load_gensim_model
+    # and WordVector memory map, vectors are saved as model_file.vectors.npy
+    # model: KeyedVectors, or path of a gensim model or word2vec text file
+    # limit: keep the limit most frequent words, models are frequency ordered
+    # words: keep only these words
+
+    import gensim
+
+    if isinstance(model, str):
+        model = load_gensim_model(model, mmap='r') if model.endswith('.model') \
+            else create_gensim_model(model, limit=limit)
+
+    keys = model.index_to_key[:limit] if limit is not None else model.index_to_key
+    if words is not None:
+        words = set(words)
+        keys = [k for k in keys if k in words]
+
+    index = np.array([model.key_to_index[k] for k in keys], dtype=np.int64)
+    res = gensim.models.KeyedVectors(model.vector_size, dtype=np.float32)
+    res.add_vectors(keys, np.asarray(model.vectors[index], dtype=np.float32))
+
+    res.save(model_file, separately=['vectors'])
+
+    return res
+
+
+def load_gensim_model(model_file="wv_100000.model", mmap='r'):
+    # mmap='r' maps the vectors of converted models read only, so processes
+    # loading the same model share its pages, None loads them into memory
+    import gensim
+
+    model = gensim.models.KeyedVectors.load(model_file, mmap=mmap)
     return model
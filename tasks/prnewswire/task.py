@@ -1,12 +1,32 @@
-from andromeda.nlp.processor import SVOStanford, WordVector
-from andromeda.nlp.util import get_org
+from andromeda.nlp.processor import get_processor
+from andromeda.nlp.util import get_org, get_org_batch
+from andromeda.util import map_chunks
+from andromeda.util.telemetry import profiled
 
 
-def create_svo(data):
+@profiled()
+def create_svo(data, use_ner=False, batch_size=100, num_workers=None, chunk=10000):
+    # use_ner: subject is the first organization found in the triple subjects
+    # batch_size: titles per openie request
+    # num_workers: annotate chunks of titles concurrently in threads,
+    #   the openie server processes the requests in parallel
 
     print('extracting svo...')
-    svo_p = SVOStanford()
-    data = data['title'].apply(svo_p.process)
+    svo_p = get_processor('svo')
+
+    if num_workers is not None:
+        # start the backends once before the threads share them
+        svo_p.processor
+        if use_ner:
+            svo_p.ner.processor
+
+    data = map_chunks(svo_p.process_batch, data['title'],
+                      num_workers=num_workers,
+                      chunk=chunk,
+                      backend='thread',
+                      use_ner=use_ner,
+                      batch_size=batch_size)
+
     data = data[~data['s'].isnull()]
     data['vo'] = data['v'] + ' ' + data['o']
     data = data[['s', 'v', 'o', 'vo']]
@@ -14,28 +34,45 @@ def create_svo(data):
     return data
 
 
-
+@profiled()
 def create_wv_average(data):
 
     print('calc word vec average...')
-    wv_p = WordVector()
-    data['wv'] = data['vo'].apply(wv_p.process)
-    data = data[~data['wv'].isnull()]
+    wv_p = get_processor('word_vector')
+    wv, mask = wv_p.process_batch(data['vo'])
+    data['wv'] = list(wv)
+    data = data[mask]
 
     return data
 
 
+@profiled()
 def create_wv_separate(data):
 
     print('calc word vec separate...')
-    wv_p = WordVector()
-    data['wv_v'] = data['v'].apply(wv_p.process)
-    data['wv_o'] = data['o'].apply(wv_p.process)
-    data = data[~data['wv_v'].isnull() & ~data['wv_o'].isnull()]
+    wv_p = get_processor('word_vector')
+    wv_v, mask_v = wv_p.process_batch(data['v'])
+    wv_o, mask_o = wv_p.process_batch(data['o'])
+    data['wv_v'] = list(wv_v)
+    data['wv_o'] = list(wv_o)
+    data = data[mask_v & mask_o]
 
     return data
 
 
+@profiled()
+def create_wv_matrix(data, column='vo'):
+    # word vector average of column as one matrix, e.g. to pass to kmean
+    # returns rows of data with known words and their matrix rows
+
+    print('calc word vec matrix...')
+    wv_p = get_processor('word_vector')
+    wv, mask = wv_p.process_batch(data[column])
+
+    return data[mask], wv[mask]
+
+
+@profiled()
 def create_org_map(subjects):
 
     org_map = {}
@@ -59,6 +96,22 @@ def create_org_map(subjects):
     return org_map
 
 
+@profiled()
+def create_org_map_batch(subjects, batch_size=1000):
+    # create_org_map with batched ner tagging of unique subjects
+
+    subjects = list(dict.fromkeys(subjects))
+    print(f"processing {len(subjects)} subjects in batches of {batch_size}")
+
+    orgs = get_org_batch(subjects, batch_size=batch_size)
+    org_map = dict(zip(subjects, orgs))
+
+    success = sum(org is not None for org in orgs)
+    print(f"stat success {success}, failure {len(orgs) - success}")
+
+    return org_map
+
+
 if __name__ == "__main__":
 
     print("tasks for pr news wire")
@@ -67,13 +120,18 @@ if __name__ == "__main__":
     # title processing
     # 1. download titles (web.wayback_machine.title.get_titles .clean_titles)
     # 2. extract s, v, o (create_svo)
-    # 3. create word vector (create_wv_average, create_wv_separate)
-    # 4. create organization map (create_org_map)
+    # 3. create word vector (create_wv_average, create_wv_separate, create_wv_matrix)
+    #    convert the word vector model once with nlp.util.convert_gensim_model
+    # 4. create organization map (create_org_map, create_org_map_batch)
     # 5. create ticker map for sp500 (nlp.util.match.create_ticker_map)
     # 6. create ticker sector for sp500 (straight from file)
     # 7. retrieve prices from yahoo finance (finance.util.common.get_prices)
 
+    # stage timings of a session: andromeda.util.get_profiler().report()
+
     # kmean clustering
+    # write the create_wv_matrix matrix with util.write_array and fit
+    # nlp.util.StreamingKMeans on the file, partial_fit and predict new titles
     # start jupyter lab
     # export PYTHONPATH=/Users/shuowang/pycharm/p001/repo
     # jupyter lab
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from andromeda.finance.analytics.performance import *
+
+
+def factor_data():
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-01-01', '2020-12-31')
+    tickers = pd.Index([f'T{i}' for i in range(20)], name='ticker')
+
+    values = np.where(rng.random((len(dates), len(tickers))) < 0.1,
+                      rng.integers(1, 4, (len(dates), len(tickers))), np.nan)
+    factor = pd.DataFrame(values, index=dates, columns=tickers)
+    returns = pd.DataFrame(rng.normal(0, 0.01, (len(dates), len(tickers))),
+                           index=dates, columns=tickers).drop(dates[::17])
+
+    return factor, returns
+
+
+def test_0001():
+
+    factor, returns = factor_data()
+
+    rets, drets, gwgts = roll_sweep(factor, returns, rolls=[2, 5, 100], trade_cost=0.001)
+    assert list(drets.columns) == ['equal weight', 'roll-None', 'roll-2', 'roll-5', 'roll-100']
+    assert gwgts['roll-2'] is None
+
+    for roll, title in [(None, 'roll-None'), (2, 'roll-2'), (5, 'roll-5'), (100, 'roll-100')]:
+        strat, _ = factor_strategy(factor, roll)
+        cum_ret, daily_ret = calc_returns(strat, returns, trade_cost=0.001)
+
+        assert np.allclose(drets[title], daily_ret, rtol=1e-12, atol=1e-15)
+        assert np.allclose(rets[title], cum_ret, rtol=1e-12, atol=1e-15)
+        assert (rets.index == cum_ret.index).all()
+
+
+def test_0002():
+
+    dates = pd.bdate_range('2021-01-04', periods=3)
+    tickers = pd.Index(['A', 'B', 'C', 'D'], name='ticker')
+    factor = pd.DataFrame([[1, 1, 2, np.nan],
+                           [np.nan, np.nan, 1, 1],
+                           [np.nan, np.nan, np.nan, np.nan]], index=dates, columns=tickers)
+    returns = pd.DataFrame(0.01, index=pd.bdate_range('2021-01-04', periods=4), columns=tickers)
+    groups = pd.DataFrame({'sector': ['Tech', 'Tech', 'Energy']}, index=pd.Index(['A', 'B', 'C'], name='ticker'))
+
+    _, drets, gwgts = performance_data_list(factor, returns, rolls=[2], groups=groups, neutral=True)
+
+    # each sector weighted to one, tickers without a sector dropped
+    weights = gwgts['roll-None']
+    assert list(weights.columns) == ['Energy', 'Tech']
+    assert weights.iloc[0].tolist() == [1, 1]
+    assert weights.iloc[1].tolist() == [1, 0]
+    assert weights.iloc[2].tolist() == [0, 0]
+    assert gwgts['roll-2'].iloc[1].tolist() == [1, 1]
+    assert gwgts['equal weight'].iloc[2].tolist() == [1, 1]
+
+    assert np.allclose(drets['roll-None'], [0.01, 0.01, 0])
+    assert np.allclose(drets['roll-2'], [0.01, 0.01, 0.01])
+
+
+def test_0003():
+
+    factor, returns = factor_data()
+    stacked = factor.stack()
+    stacked.index.names = ['date', 'ticker']
+    data = pd.DataFrame({'acquisition': stacked,
+                         'lawsuit': stacked.sample(frac=0.5, random_state=1),
+                         'dividend': stacked.sample(frac=0.3, random_state=2)})
+    groups = pd.DataFrame({'sector': ['Tech', 'Energy', 'Health'] * 6},
+                          index=pd.Index([f'T{i}' for i in range(18)], name='ticker'))
+
+    res = analyze_factors(['lawsuit', 'acquisition', 'dividend'], data, returns, groups,
+                          rolls=[2, 5], num_workers=2, verbose=False)
+
+    assert list(res.columns) == ['Sharpe', 'Volatility']
+    assert list(res.index.names) == ['factor', 'neutral', 'strategy']
+    assert list(res.index.get_level_values(0).unique()) == ['lawsuit', 'acquisition', 'dividend']
+
+    for name in ['lawsuit', 'dividend']:
+        for neutral in [False, True]:
+            _, drets, _ = performance_data_list(factor_frame(data[name], returns.columns), returns,
+                                                rolls=[2, 5], trade_cost=0, groups=groups, neutral=neutral)
+            expected = calc_performance(drets, drets['equal weight'])
+            found = res[(res.index.get_level_values('factor') == name) &
+                        (res.index.get_level_values('neutral') == neutral)].droplevel([0, 1])
+            pd.testing.assert_frame_equal(found, expected, check_names=False)
+
+
+if __name__ == "__main__":
+
+    test_0001()
+    test_0002()
+    test_0003()
+
+    print("success")
@@ -1,5 +1,8 @@
+import sys
+
 from andromeda.nlp.util import *
 from andromeda.nlp.processor import *
+from andromeda.nlp.tagger import *
 
 
 def test_0001():
@@ -124,6 +127,477 @@ def test_0009():
                     ('some', 'DT'), ('eggs', 'NNS'), ('.', '.')]
 
 
+def test_0010():
+
+    ner = NERStanford(backend=FakeTagger({'APPLE': 'ORGANIZATION', 'JOHN': 'PERSON'}))
+
+    res = ner.process_batch([['APPLE', 'BUYS'], [], ['JOHN', 'SELLS']])
+    assert res == [[('APPLE', 'ORGANIZATION'), ('BUYS', 'O')],
+                   [],
+                   [('JOHN', 'PERSON'), ('SELLS', 'O')]]
+    assert ner.processor.calls == 1
+
+    assert [ner.first_ne(r, 'ORGANIZATION') for r in res] == ['APPLE', None, None]
+
+
+# serves slash tagged lines like the stanford ner server, one line per connection
+FAKE_SERVER = """
+import socket, sys
+port = int(sys.argv[sys.argv.index('-port') + 1])
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(('127.0.0.1', port))
+server.listen(16)
+while True:
+    conn, _ = server.accept()
+    line = conn.makefile('r').readline()
+    tags = [w + ('/ORGANIZATION' if w.isupper() else '/O') for w in line.split()]
+    conn.sendall(' '.join(tags).encode('utf8'))
+    conn.close()
+"""
+
+
+def make_server_ner():
+    return NERStanford(backend=TaggerServer([sys.executable, '-c', FAKE_SERVER, 'test-0023'], separator='/'))
+
+
+def server_tag(words):
+    from andromeda.nlp.processor import get_processor
+    return get_processor('server_ner').process(words)
+
+
+def running_servers(marker):
+    import subprocess
+    out = subprocess.run(['ps', '-ww', '-eo', 'args'], capture_output=True, text=True).stdout
+    return [line for line in out.splitlines() if f'{marker} -port' in line]
+
+
+def test_0011():
+
+    server = TaggerServer([sys.executable, '-c', FAKE_SERVER], separator='/', processes=2)
+    try:
+        ner = NERStanford(backend=server)
+
+        res = ner.process(['APPLE', 'buys', 'a/b'])
+        assert res == [('APPLE', 'ORGANIZATION'), ('buys', 'O'), ('a/b', 'O')]
+
+        res = ner.process_batch([['IBM', 'sells'], [], ['x'] * 100])
+        assert res[0] == [('IBM', 'ORGANIZATION'), ('sells', 'O')]
+        assert res[1] == []
+        assert res[2] == [('x', 'O')] * 100
+    finally:
+        server.close()
+
+
+def test_0012():
+
+    import gensim
+    import numpy as np
+
+    kv = gensim.models.KeyedVectors(vector_size=2)
+    kv.add_vectors(['buy', 'sell'], np.array([[1, 0], [0, 1]], dtype=np.float32))
+    wv = WordVector()
+    wv._processor = kv
+
+    texts = ['Buy sell', 'unknown', 'buy buy']
+    res, mask = wv.process_batch(texts, batch_size=2)
+
+    assert res.dtype == np.float32
+    assert list(mask) == [True, False, True]
+    assert np.allclose(res, [[0.5, 0.5], [0, 0], [1, 0]])
+    assert np.allclose(res[0], wv.process(texts[0]))
+
+
+def test_0013(tmp_path):
+
+    import os
+    import gensim
+    import numpy as np
+
+    kv = gensim.models.KeyedVectors(vector_size=2)
+    kv.add_vectors(['the', 'buy', 'sell', 'rare'],
+                   np.arange(8, dtype=np.float32).reshape(4, 2))
+
+    model_file = os.path.join(str(tmp_path), 'wv.model')
+    convert_gensim_model(kv, model_file, limit=3, words=['buy', 'sell', 'rare'])
+    assert os.path.exists(model_file + '.vectors.npy')
+
+    res = load_gensim_model(model_file)
+    assert isinstance(res.vectors, np.memmap)
+    assert res.index_to_key == ['buy', 'sell']
+    assert np.array_equal(res['sell'], kv['sell'])
+
+    wv = WordVector(model_file)
+    assert isinstance(wv.processor.vectors, np.memmap)
+
+
+def test_0014(tmp_path):
+
+    import os
+
+    words = ['tires', 'tired', 'tires', 'boring', 'tires']
+
+    stm = Stemmer(cache_size=2)
+    res = stm.process_batch(words)
+    assert res == ['tire', 'tire', 'tire', 'bore', 'tire']
+    assert res == stm.process(words)
+    assert len(stm._tokens) == 2
+
+    file = os.path.join(str(tmp_path), 'vocab.pkl')
+    stm.save_vocab(file)
+
+    # preloaded tokens never reach the stemmer
+    stm = Stemmer(vocab=file)
+    stm._processor = FakeTagger()
+    assert stm.process(['tires', 'boring']) == ['tire', 'bore']
+
+
+def test_0015():
+
+    import pandas as pd
+
+    cleaner = TextCleaner(lemmatizer=Stemmer(), stop_words=StopWords(['the', 'of']))
+    texts = pd.Series(['The sales of 2021Q1 rose, sharply!', 'the'], index=['a', 'b'])
+
+    res = cleaner.clean_batch(texts)
+    assert list(res.index) == ['a', 'b']
+    assert list(res) == ['sale q rose sharpli', '']
+
+    res = cleaner.clean_batch(list(texts), tokens=True, num_workers=2, chunk=1)
+    assert res == [['sale', 'q', 'rose', 'sharpli'], []]
+
+
+class FakeOpenIE:
+    # openie client answering with the first word as subject, the second as
+    # relation and the rest as object for every line, counts requests
+
+    def __init__(self):
+        self.calls = 0
+
+    def annotate(self, text, properties=None, simple_format=True):
+        self.calls = self.calls + 1
+
+        sentences = []
+        offset = 0
+        for line in text.split('\n'):
+            words = line.split()
+            if len(words) > 0:
+                triples = [{'subject': words[0], 'relation': words[1], 'object': ' '.join(words[2:])}] \
+                    if len(words) > 2 else []
+                sentences.append({'tokens': [{'characterOffsetBegin': offset + line.index(words[0])}],
+                                  'openie': triples})
+            offset = offset + len(line) + 1
+
+        if simple_format:
+            return [t for sentence in sentences for t in sentence['openie']]
+        return {'sentences': sentences}
+
+
+def test_0016():
+
+    import pandas as pd
+
+    svo = SVOStanford()
+    svo._processor = FakeOpenIE()
+
+    titles = pd.Series(['Apple buys  Beats', '', 'short', 'IBM sells unit'], index=list('abcd'))
+    res = svo.process_batch(titles, batch_size=3)
+
+    assert svo.processor.calls == 2
+    assert list(res.index) == list('abcd')
+    assert list(res.loc['a']) == ['Apple', 'buys', 'Beats']
+    assert list(res.loc['d']) == ['IBM', 'sells', 'unit']
+    assert res.loc[['b', 'c'], 's'].isnull().all()
+
+
+def test_0017():
+
+    from andromeda.nlp.util.match import TickerMatcher, get_matches_fuzzy, create_ticker_map
+
+    tickers = [('AAPL APPLE INC.', 'AAPL'), ('IBM INTERNATIONAL BUSINESS MACHINES', 'IBM'),
+               ('MSFT MICROSOFT CORP.', 'MSFT'), ('AMZN AMAZON.COM INC.', 'AMZN'),
+               ('MMM 3M', 'MMM'), ('HPQ HP INC.', 'HPQ'), ('GE GENERAL ELECTRIC', 'GE')]
+    subjects = ['APPLE', 'MICROSOFT CORP', 'INTERNATIONAL BUSINESS MACHINES', 'ACME WIDGETS', 'APPLE',
+                '3M', 'HP', 'GE', 'GENERAL ELECTRIC CO']
+
+    exact = TickerMatcher(tickers, min_overlap=0)
+    indexed = TickerMatcher(tickers)
+    for subject in subjects:
+        expected = get_matches_fuzzy(subject, tickers)
+        assert [s for s, _ in exact.match(subject)] == expected
+        assert [s for s, _ in indexed.match(subject)] == expected
+
+    assert len(indexed.candidates('MICROSOFT CORP')) < len(tickers)
+
+    # subjects shorter than the ngrams still match
+    assert TickerMatcher([('T0 3M', 'T0')]).match('3M') == [('T0', 100)]
+    assert [s for s, _ in indexed.match('HP')] == get_matches_fuzzy('HP', tickers) != []
+
+    indexed.add_alias('BIG BLUE', ['IBM'])
+    res = create_ticker_map(subjects + ['BIG BLUE'], tickers, matcher=indexed, scores=True)
+    assert res['BIG BLUE'] == [('IBM', 100)]
+    assert res['ACME WIDGETS'] == []
+    assert res['APPLE'][0][0] == 'AAPL' and res['APPLE'][0][1] > 80
+
+
+def test_0018():
+
+    import pandas as pd
+
+    stop_words = {'the', 'of', 'a', 'and', 'to', 'in', 'is', 'for', 'on', 'its'}
+    lf = LanguageFilter(stop_words=stop_words, sample_size=200)
+
+    english = 'The company announced the results of the quarter and a plan to grow in the region'
+    spanish = 'La empresa anunció hoy los resultados del trimestre y un nuevo plan de crecimiento regional'
+    german = 'Das Unternehmen hat heute die Ergebnisse des Quartals und einen neuen Wachstumsplan bekannt gegeben'
+
+    assert lf.stop_word_ratio(lf.sample(english)) >= 0.25
+    assert lf.check(english) is True
+    assert lf.check(spanish) is False
+    assert lf.check('12345 !!!') is None
+    assert len(lf.sample('x ' * 1000)) == 200
+
+    # the detector is seeded, repeated checks agree without the cache
+    detector = LanguageFilter(stop_words=stop_words, stop_ratio=None, cache_size=0)
+    assert len({detector.check(german) for _ in range(5)}) == 1
+    assert detector.languages(detector.sample(english))[0][0] == 'en'
+
+    texts = pd.Series([english, spanish, english.upper(), german], index=list('abcd'))
+    res = lf.check_batch(texts)
+    assert list(res.index) == list('abcd')
+    assert list(res) == [True, False, True, False]
+
+
+def test_0019(tmp_path):
+
+    import numpy as np
+    from andromeda.util import write_array
+
+    rng = np.random.default_rng(0)
+    centers = np.array([[10, 0, 0], [0, 10, 0], [0, 0, 10]], dtype=np.float32)
+    labels = rng.integers(0, 3, 3000)
+    matrix = centers[labels] + rng.normal(0, 0.5, (3000, 3)).astype(np.float32)
+    mask = np.ones(3000, dtype=bool)
+    mask[:10] = False
+
+    file = str(tmp_path / 'wv.npy')
+    write_array(matrix, file)
+
+    km = StreamingKMeans(3, batch_size=500).fit(file, mask=mask)
+    assert km.n_seen == 2990
+
+    pred = km.predict(file, mask=mask)
+    assert (pred[:10] == -1).all()
+    # clusters match the generating centers up to relabeling
+    pairs = set(zip(labels[10:], pred[10:]))
+    assert len(pairs) == 3
+
+    # new vectors update the centroids and are assigned without a refit
+    new = centers + 0.1
+    km.partial_fit(new[:2])
+    km.partial_fit(new[2:])
+    assert km.n_seen == 2993
+    assert list(km.predict(new)) == [dict(pairs)[i] for i in range(3)]
+
+    model_file = str(tmp_path / 'km.pkl')
+    km.save(model_file)
+    assert (StreamingKMeans.load(model_file).predict(matrix) == km.predict(matrix)).all()
+
+    # the first update waits for n_clusters vectors
+    km = StreamingKMeans(3)
+    km.partial_fit(new[:2])
+    assert not km.fitted
+    km.partial_fit(new[2:])
+    assert km.fitted and km.n_seen == 3
+
+
+def test_0020():
+
+    import subprocess
+
+    # heavy dependencies are loaded on first use, not on import
+    code = """
+import sys, time
+start = time.perf_counter()
+import andromeda.nlp.util, andromeda.nlp.processor, andromeda.nlp.tagger
+elapsed = time.perf_counter() - start
+heavy = ('nltk', 'sklearn', 'langdetect', 'gensim', 'openie')
+print(elapsed, ' '.join(m for m in heavy if m in sys.modules))
+"""
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    elapsed, *loaded = out.stdout.split()
+
+    assert loaded == []
+    assert float(elapsed) < 2.0
+
+
+def test_0021():
+
+    tags = {'I': 'PRP', 'ate': 'VBD', 'McDonald': 'NNP', 'breakfast': 'NN', 'in': 'IN',
+            'the': 'DT', 'morning': 'NN', '.': '.', 'Apple': 'NNP', 'Inc': 'NNP'}
+    pos = POSStanford(backend=FakeTagger(tags))
+
+    words = ['I', 'ate', 'McDonald', 'breakfast', 'in', 'the', 'morning', '.']
+    assert pos.process(words) == [('I', 'PRP'), ('ate', 'VBD'), ('McDonald breakfast', 'NN'),
+                                  ('in', 'IN'), ('the', 'DT'), ('morning', 'NN'), ('.', '.')]
+    assert pos.process(words, merge_nn=False) == [(w, tags[w]) for w in words]
+
+    # noun runs do not cross sentences
+    tokens, pos_tags, sent_ids = pos.process_batch([words, [], ['morning', 'Apple', 'Inc'], ['I']])
+    assert pos.processor.calls == 3
+    assert list(tokens) == ['I', 'ate', 'McDonald breakfast', 'in', 'the', 'morning', '.',
+                            'morning Apple Inc', 'I']
+    assert list(pos_tags) == ['PRP', 'VBD', 'NN', 'IN', 'DT', 'NN', '.', 'NNP', 'PRP']
+    assert list(sent_ids) == [0, 0, 0, 0, 0, 0, 0, 2, 3]
+
+    tokens, pos_tags, sent_ids = pos.process_batch([['morning'], ['Apple']], merge_nn=False)
+    assert list(tokens) == ['morning', 'Apple'] and list(sent_ids) == [0, 1]
+
+    assert [len(a) for a in pos.process_batch([[]])] == [0, 0, 0]
+
+
+def test_0022(tmp_path):
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+    mask = np.ones(2000, dtype=bool)
+    mask[0] = False
+
+    index = VectorIndex(n_probe=4, compact_size=100).build(vectors, mask=mask)
+    assert len(index) == 1999
+
+    # exact when every list is probed
+    normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[1:6] + 0.01
+    expected = np.argsort(-(queries @ normed[1:].T), axis=1)[:, :5] + 1
+    keys, scores = index.search(queries, k=5, n_probe=len(index.centroids))
+    assert (keys == expected).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+    keys, scores = index.search(vectors[7], k=3)
+    assert keys.shape == (3,) and keys[0] == 7 and np.isclose(scores[0], 1)
+
+    # added vectors are found before and after compaction
+    new = rng.normal(size=(60, 16)).astype(np.float32)
+    added = index.add(new)
+    assert list(added[:2]) == [2000, 2001]
+    assert index.search(new[0], k=1)[0][0] == 2000
+    index.add(rng.normal(size=(60, 16)))
+    assert len(index._extra_keys) == 0 and len(index) == 2119
+    assert index.search(new[59], k=1)[0][0] == 2059
+
+    path = str(tmp_path / 'index')
+    index.save(path)
+    loaded = VectorIndex.load(path)
+    assert isinstance(loaded.vectors, np.memmap)
+    assert (loaded.search(queries, k=5)[0] == index.search(queries, k=5)[0]).all()
+    assert loaded.add(new[:1])[0] == 2120
+
+    class FakeWordVector:
+        def process_batch(self, texts):
+            return vectors[:len(texts)], np.array([t != '' for t in texts])
+
+    keys, _ = index.search_texts(['a', '', 'b'], k=2, wv=FakeWordVector())
+    assert list(keys[1]) == [-1, -1]
+    assert keys[2][0] == 2
+
+
+def test_0023():
+
+    import time
+    from andromeda.util import multi_run
+
+    # servers started in pool workers stop with the workers, which exit
+    # without running atexit
+    failures = multi_run(server_tag, None, [['APPLE', 'x'], ['IBM'], ['y'], ['z']], num_workers=2,
+                         processors={'server_ner': make_server_ner})
+    assert failures == {}
+
+    for _ in range(100):
+        if len(running_servers('test-0023')) == 0:
+            break
+        time.sleep(0.1)
+
+    assert running_servers('test-0023') == []
+
+
+def test_0024(tmp_path):
+
+    import os
+    from andromeda.util.cache import DiskCache, set_cache
+    from andromeda.nlp.util.task import clean_sentence, get_org
+
+    class KeepToken(TokenProcessor):
+        def process_token(self, word):
+            return word
+
+    def ner(model, tags):
+        return NERStanford(model_path=model, backend=FakeTagger(tags))
+
+    # cached results are not shared across the processors registered by name
+    set_cache(DiskCache(os.path.join(str(tmp_path), 'cache.sqlite')))
+    try:
+        register_processor('stop_words', lambda: StopWords(['the']))
+        register_processor('lemmatizer', Stemmer)
+        assert clean_sentence('The sales rose') == 'sale rose'
+        register_processor('lemmatizer', KeepToken)
+        assert clean_sentence('The sales rose') == 'sales rose'
+        register_processor('stop_words', lambda: StopWords(['the', 'rose']))
+        assert clean_sentence('The sales rose') == 'sales'
+
+        register_processor('ner', lambda: ner('a', {'APPLE': 'ORGANIZATION'}))
+        assert get_org('Apple buys IBM') == 'APPLE'
+        register_processor('ner', lambda: ner('b', {'IBM': 'ORGANIZATION'}))
+        assert get_org('Apple buys IBM') == 'IBM'
+
+        svo = SVOStanford(ner=ner('a', {'Apple': 'ORGANIZATION'}))
+        svo._processor = FakeOpenIE()
+        assert svo.process('Apple buys Beats', use_ner=True)['s'] == 'Apple'
+        svo._ner = ner('b', {})
+        assert svo.process('Apple buys Beats', use_ner=True)['s'] is None
+    finally:
+        set_cache(None)
+        register_processor('stop_words', StopWords)
+        register_processor('lemmatizer', Lemmatizer)
+        register_processor('ner', NERStanford)
+
+
+def test_0025():
+
+    import threading
+
+    class Echo(TokenProcessor):
+        def process_token(self, word):
+            return word
+
+    # threads sharing a full token cache evict without errors
+    echo = Echo(cache_size=2)
+    errors = []
+
+    def work(k):
+        try:
+            for i in range(20000):
+                assert echo.process(f'{k}-{i}') == f'{k}-{i}'
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert len(echo._tokens) == 2
+
+
 if __name__ == "__main__":
 
     test_0001()
@@ -135,6 +609,17 @@ if __name__ == "__main__":
     test_0007()
     test_0008()
     test_0009()
+    test_0010()
+    test_0011()
+    test_0012()
+    test_0015()
+    test_0016()
+    test_0017()
+    test_0018()
+    test_0020()
+    test_0021()
+    test_0023()
+    test_0025()
 
     print("success")
 
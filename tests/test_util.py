@@ -0,0 +1,428 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from andromeda.util import *
+
+
+def square(x):
+    return x * x
+
+
+def fail_on_two(x):
+    if x == 2:
+        raise ValueError("bad chunk")
+    return x
+
+
+def die_on_two(x):
+    if x == 2:
+        os._exit(1)
+    time.sleep(0.2)
+    return x
+
+
+class CountingProcessor:
+
+    created = 0
+
+    def __init__(self):
+        CountingProcessor.created = CountingProcessor.created + 1
+        self.processor = None
+
+
+def created_processors(x):
+    from andromeda.nlp.processor import get_processor
+    get_processor('counting')
+    return CountingProcessor.created
+
+
+async def slow_square(x):
+    await asyncio.sleep(0.2)
+    return x * x
+
+
+def test_0001():
+
+    data_list = [1, 2, 3, 4]
+
+    res = list(multi_run_iter(square, None, data_list, num_workers=2, verbose=False))
+
+    assert sorted(r.idx for r in res) == [0, 1, 2, 3]
+    assert sorted(r.result for r in res) == [1, 4, 9, 16]
+    assert all(r.error is None for r in res)
+
+
+def test_0002():
+
+    data_list = [1, 2, 3]
+
+    res = {r.idx: r for r in multi_run_iter(fail_on_two, None, data_list, num_workers=2, verbose=False)}
+
+    assert res[0].result == 1 and res[2].result == 3
+    assert res[1].result is None
+    assert 'ValueError: bad chunk' in res[1].error
+
+    failures = multi_run(fail_on_two, None, data_list, num_workers=2, verbose=False)
+    assert list(failures.keys()) == [1]
+
+
+def test_0003(tmp_path):
+
+    path = str(tmp_path)
+    data_list = [{'a': 1, 'b': 2}, {'c': 3}, {'d': 4}]
+
+    res = list(multi_run_iter(len, path, data_list, num_workers=2, verbose=False))
+    assert len(res) == 3
+    assert Manifest(path).done() == [0, 1, 2]
+    assert read_pickle(os.path.join(path, '0.pkl')) == 2
+
+    # nothing left to do on rerun
+    res = list(multi_run_iter(len, path, data_list, num_workers=2, verbose=False))
+    assert len(res) == 0
+
+    # only changed or missing chunks are rerun
+    data_list[1] = {'c': 3, 'e': 5}
+    os.remove(os.path.join(path, '2.pkl'))
+    res = list(multi_run_iter(len, path, data_list, num_workers=2, verbose=False))
+    assert sorted(r.idx for r in res) == [1, 2]
+    assert read_pickle(os.path.join(path, '1.pkl')) == 2
+
+    # ignore reruns everything
+    res = list(multi_run_iter(len, path, data_list, num_workers=2, ignore=True, verbose=False))
+    assert len(res) == 3
+
+
+def test_0004():
+
+    data_list = [1, 2, 3, 4]
+
+    res = list(multi_run_iter(created_processors, None, data_list,
+                              num_workers=1, verbose=False,
+                              processors={'counting': CountingProcessor}))
+
+    # built once by the worker initializer and reused for every chunk
+    assert [r.result for r in res] == [1, 1, 1, 1]
+
+    # threads share one instance, built once in this process and kept when
+    # the same factory is registered again
+    CountingProcessor.created = 0
+    for backend in ['thread', 'asyncio']:
+        res = list(multi_run_iter(created_processors, None, list(range(16)),
+                                  backend=backend, concurrency=8, verbose=False,
+                                  processors={'counting': CountingProcessor}))
+        assert [r.result for r in res] == [1] * 16
+
+
+def test_0005():
+
+    data = {f'k{i}': i for i in range(25)}
+
+    res = chunk_dict(data, chunk=10)
+    assert [len(r) for r in res] == [10, 10, 5]
+
+    res = chunk_dict(data, chunk=10, max_tasks=2)
+    assert [len(r) for r in res] == [10, 10]
+
+    res = chunk_iter(iter(data.items()), chunk=10)
+    assert not isinstance(res, list)
+    assert list(res) == chunk_dict(data, chunk=10)
+
+
+def test_0006():
+
+    data = {'a': {'body': 'x' * 10},
+            'b': {'body': 'x' * 2},
+            'c': {'body': 'x' * 3},
+            'd': {'body': 'x' * 30},
+            'e': {'body': ''}}
+
+    res = list(chunk_iter(data, chunk=None, cost=len_cost('body'), max_cost=12))
+    assert [list(r.keys()) for r in res] == [['a', 'b'], ['c'], ['d'], ['e']]
+
+    res = list(balanced_chunks(data, num_workers=2, chunks_per_worker=1, cost=len_cost('body')))
+    assert [list(r.keys()) for r in res] == [['a', 'b', 'c'], ['d'], ['e']]
+
+    # one-shot iterators are not consumed by the cost pass
+    res = list(balanced_chunks(iter(data.items()), num_workers=2, chunks_per_worker=1, cost=len_cost('body')))
+    assert [list(r.keys()) for r in res] == [['a', 'b', 'c'], ['d'], ['e']]
+
+
+def test_0007(tmp_path):
+
+    file = os.path.join(str(tmp_path), 'articles.parquet')
+    data = pd.DataFrame(data={'date': pd.bdate_range('2021-01-04', periods=10),
+                              'title': [f'title {i}' for i in range(10)],
+                              'body': [f'body {i}' * 100 for i in range(10)]}).set_index('date')
+
+    write_table(data, file, row_group_size=3)
+    assert table_rows(file) == 10
+
+    res = read_table(file)
+    pd.testing.assert_frame_equal(res, data)
+
+    res = read_table(file, columns=['title'], rows=(2, 7))
+    pd.testing.assert_frame_equal(res, data[['title']].iloc[2:7])
+
+    # rows of a default index keep their positions
+    data = data.reset_index()
+    write_table(data, file, row_group_size=3)
+    pd.testing.assert_frame_equal(read_table(file, rows=(8, 20)), data.iloc[8:])
+    pd.testing.assert_frame_equal(read_table(file, rows=(4, 4)), data.iloc[4:4])
+
+
+def test_0008(tmp_path):
+
+    file = os.path.join(str(tmp_path), 'wv.npy')
+    data = [np.full(4, i, dtype=np.float32) for i in range(6)]
+
+    write_array(data, file)
+
+    res = read_array(file)
+    assert isinstance(res, np.memmap)
+    assert res.shape == (6, 4)
+
+    res = read_array(file, rows=(1, 3), mmap=False)
+    assert np.array_equal(res, np.stack(data[1:3]))
+    assert not isinstance(res, np.memmap) and res.flags.owndata and res.flags.writeable
+
+
+def test_0009(tmp_path):
+
+    path = str(tmp_path)
+    for idx in range(12):
+        write_pickle(({f'a{idx}': idx}, {f'f{idx}': idx}, {}),
+                     os.path.join(path, f'{idx}.pkl'))
+    write_pickle([1], os.path.join(path, 'other.pkl'))
+
+    assert [os.path.basename(f) for f in shard_files(path)][:3] == ['0.pkl', '1.pkl', '2.pkl']
+
+    articles, fail_art, inva_art = merge_shards(path, num_workers=2, max_pending=3)
+    assert articles == {f'a{idx}': idx for idx in range(12)}
+    assert fail_art == {f'f{idx}': idx for idx in range(12)}
+    assert inva_art == {}
+
+    articles, _, _ = merge_shards(path, idx=range(3))
+    assert articles == {'a0': 0, 'a1': 1, 'a2': 2}
+
+    # with a manifest, only its completed chunks are merged
+    manifest = Manifest(path)
+    for idx in [0, 4]:
+        manifest.mark_done(idx, 'hash')
+    articles, _, _ = merge_shards(path)
+    assert articles == {'a0': 0, 'a4': 4}
+
+
+def test_0010(tmp_path):
+
+    path = str(tmp_path)
+    for idx in range(5):
+        data = pd.DataFrame(data={'x': [idx, idx]})
+        write_pickle((data, [idx]), os.path.join(path, f'{idx}.pkl'))
+
+    out = os.path.join(path, 'merged', 'all.pkl')
+    data, items = merge_shards(path, concat_every=2, out=out)
+    assert list(data['x']) == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+    assert items == [0, 1, 2, 3, 4]
+    assert read_pickle(out)[1] == items
+
+
+def test_0011(tmp_path):
+
+    data_list = list(range(20))
+
+    for backend in ['thread', 'asyncio']:
+        res = list(multi_run_iter(fail_on_two, None, data_list, backend=backend,
+                                  concurrency=5, verbose=False))
+        assert sorted(r.result for r in res if r.error is None) == [0, 1] + list(range(3, 20))
+        assert [r.idx for r in res if r.error is not None] == [2]
+
+    # coroutine functions run concurrently on the event loop
+    start = time.time()
+    res = list(multi_run_iter(slow_square, str(tmp_path), data_list, backend='asyncio',
+                              concurrency=20, verbose=False))
+    assert time.time() - start < 2
+    assert sorted(r.result for r in res) == [x * x for x in data_list]
+    assert read_pickle(os.path.join(str(tmp_path), '3.pkl')) == 9
+
+
+def test_0012(tmp_path):
+
+    file = os.path.join(str(tmp_path), 'cache.sqlite')
+    cache = DiskCache(file, max_items=2)
+
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    cache.set('b', None)
+    assert cache.get('a') == 1
+    assert cache.get('b', 'missing') is None
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+    # a new process or run finds the values on disk
+    cache = DiskCache(file)
+    assert cache.get('a') == 1
+    assert cache.stats()['disk_hits'] == 1
+
+    # least recently used values are evicted above max_bytes
+    cache = DiskCache(file, max_bytes=5000)
+    cache.clear()
+    for i in range(20):
+        cache.set(f'k{i}', b'x' * 1000)
+    assert cache.size() <= 5000
+    assert DiskCache(file).get('k19') is not None
+    assert DiskCache(file).get('k0') is None
+
+
+calls = []
+
+
+@memoize('test', key=lambda text, upper=False: (text, upper) if len(text) > 0 else None)
+def count_calls(text, upper=False):
+    calls.append(text)
+    return text.upper() if upper else text
+
+
+def test_0013(tmp_path):
+
+    set_cache(None)
+    count_calls('a')
+    count_calls('a')
+    assert calls == ['a', 'a']
+
+    cache = DiskCache(os.path.join(str(tmp_path), 'cache.sqlite'))
+    set_cache(cache)
+    try:
+        assert count_calls('b') == 'b'
+        assert count_calls('b') == 'b'
+        assert count_calls('b', upper=True) == 'B'
+        count_calls('')
+        count_calls('')
+        assert calls == ['a', 'a', 'b', 'b', '', '']
+        assert cache.stats()['hits'] == 1
+    finally:
+        set_cache(None)
+
+
+def test_0014():
+
+    date_strings = ["Jan 07, 2021,  11:00 ET", "Dec 31, 2020,  09:30 ET"]
+
+    res = str_to_dates(date_strings)
+    assert list(res) == [str_to_date(d) for d in date_strings]
+
+    res = str_to_dates(pd.Series(date_strings, index=['a', 'b']))
+    assert list(res.index) == ['a', 'b']
+
+
+@profiled(items=lambda data, scale=1: len(data) * scale)
+def total(data, scale=1):
+    return sum(data) * scale
+
+
+def test_0015(tmp_path):
+
+    set_profiler(Profiler())
+    total([1, 2, 3])
+    total([1, 2], scale=2)
+
+    res = get_profiler().summary()['stages']['total']
+    assert res['calls'] == 2
+    assert res['items'] == 7
+    assert res['wall'] >= 0 and res['cpu'] >= 0
+
+    profiler = Profiler()
+    data_list = [[1, 2], [3], [4, 5, 6]]
+    list(multi_run_iter(len, None, data_list, num_workers=2, verbose=False, profiler=profiler))
+
+    res = profiler.summary()
+    assert res['stages']['multi_run:len']['calls'] == 3
+    assert res['stages']['multi_run:len']['items'] == 6
+    assert sum(w['multi_run:len']['calls'] for w in res['workers'].values()) == 3
+
+    file = os.path.join(str(tmp_path), 'profile.json')
+    multi_run(len, None, data_list, num_workers=2, verbose=False, profile_file=file)
+    assert os.path.exists(file)
+
+
+def test_0016():
+
+    # a dead worker fails its chunk instead of hanging the run, the other
+    # chunks lost with its pool are run again
+    data_list = list(range(1, 13))
+
+    res = {r.idx: r for r in multi_run_iter(die_on_two, None, data_list, num_workers=2, verbose=False)}
+
+    assert sorted(res) == list(range(12))
+    assert 'worker process died' in res[1].error
+    assert all(res[i].error is None and res[i].result == i + 1 for i in res if i != 1)
+
+
+def test_0017():
+
+    import warnings
+
+    # the asyncio backend also runs when called from a running event loop
+    async def main():
+        return list(multi_run_iter(slow_square, None, list(range(10)), backend='asyncio',
+                                   concurrency=10, verbose=False))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        res = asyncio.run(main())
+
+    assert sorted(r.result for r in res) == [x * x for x in range(10)]
+
+    # closing early cancels the running chunks
+    results = multi_run_iter(slow_square, None, list(range(10)), backend='asyncio',
+                             concurrency=2, verbose=False)
+    assert next(results).error is None
+    results.close()
+
+
+def double_all(items, offset=0):
+    if any(x is None for x in items):
+        raise ValueError('missing item')
+    return [2 * x + offset for x in items]
+
+
+def double_frame(items):
+    return pd.DataFrame({'x': 2 * items})
+
+
+def test_0018():
+
+    # results of chunks are joined in order, with the index of a series
+    assert map_chunks(double_all, range(5)) == [0, 2, 4, 6, 8]
+    assert map_chunks(double_all, range(5), num_workers=2, chunk=2, offset=1) == [1, 3, 5, 7, 9]
+
+    items = pd.Series([1, 2, 3], index=['a', 'b', 'c'])
+    res = map_chunks(double_all, items, num_workers=2, chunk=2, backend='thread')
+    pd.testing.assert_series_equal(res, 2 * items)
+
+    res = map_chunks(double_frame, items, num_workers=2, chunk=1)
+    pd.testing.assert_frame_equal(res, pd.DataFrame({'x': 2 * items}))
+    assert list(map_chunks(double_frame, items.iloc[:0], num_workers=2).columns) == ['x']
+
+    try:
+        map_chunks(double_all, [1, None, 3], num_workers=2, chunk=1)
+        assert False
+    except RuntimeError as e:
+        assert 'failed to process chunk 1' in str(e) and 'missing item' in str(e)
+
+
+if __name__ == "__main__":
+
+    test_0001()
+    test_0002()
+    test_0004()
+    test_0005()
+    test_0006()
+    test_0014()
+    test_0016()
+    test_0017()
+    test_0018()
+
+    print("success")
@@ -0,0 +1,25 @@
+import datetime as dt
+
+from andromeda.web.wayback_machine.title import *
+
+
+def test_0001():
+
+    title_dict = {
+        'first title 2021': {'url': None, 'timestamps': {'20210105120000', '20210103090000'}},
+        '': {'url': None, 'timestamps': {'20200101000000'}},
+        'second title': {'url': None, 'timestamps': {'20201231235959'}},
+    }
+
+    res = clean_titles(title_dict)
+
+    assert list(res['title']) == ['second title', 'first title ']
+    assert list(res.index) == [dt.datetime(2020, 12, 31, 23, 59, 59),
+                               dt.datetime(2021, 1, 3, 9, 0, 0)]
+
+
+if __name__ == "__main__":
+
+    test_0001()
+
+    print("success")
@@ -1,3 +1,8 @@
 from .common import *
+from .cache import *
+from .telemetry import *
+from .manifest import *
 from .multi import *
 from .chunk import *
+from .storage import *
+from .merge import *
@@ -0,0 +1,272 @@
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from andromeda.config import CACHE_DIR
+
+
+_missing = object()
+
+
+def make_key(*args):
+    # content hash of picklable arguments, e.g. namespace, config and text
+
+    return hashlib.sha1(pickle.dumps(args, protocol=4)).hexdigest()
+
+
+class DiskCache:
+    # in memory lru in front of a persistent sqlite store
+    # the store can be shared by processes, e.g. multi_run workers,
+    # each process keeps its own lru and hit/miss counts
+    # file: sqlite file, None to only cache in memory
+    # max_bytes: size of the stored values above which the least recently
+    #   used entries are evicted from the store
+    # max_items: number of entries kept in memory
+    # cached values are shared between callers and should not be modified
+
+    def __init__(self, file=None, max_bytes=1 << 30, max_items=100000):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._added = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # connections and locks do not survive pickling, reopened on use
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        state['_lock'] = None
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connection(self):
+
+        if self._conn is None or self._pid != os.getpid():
+            path = os.path.dirname(self.file)
+            if len(path) > 0:
+                os.makedirs(path, exist_ok=True)
+
+            conn = sqlite3.connect(self.file, timeout=60, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            conn.commit()
+
+            self._conn = conn
+            self._pid = os.getpid()
+
+        return self._conn
+
+    def _remember(self, key, value):
+
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            if key in self._memory:
+                self.hits = self.hits + 1
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self.file is not None:
+                conn = self._connection()
+                row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+                    conn.commit()
+                    value = pickle.loads(row[0])
+                    self.hits = self.hits + 1
+                    self.disk_hits = self.disk_hits + 1
+                    self._remember(key, value)
+                    return value
+
+            self.misses = self.misses + 1
+            return default
+
+    def set(self, key, value):
+
+        with self._lock:
+            self._remember(key, value)
+
+            if self.file is None:
+                return
+
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            conn = self._connection()
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                         (key, data, len(data), time.time()))
+            conn.commit()
+
+            # the store size is only checked every 1% of max_bytes written
+            self._added = self._added + len(data)
+            if self._added * 100 >= self.max_bytes:
+                self._added = 0
+                self._evict(conn)
+
+    def _evict(self, conn):
+        # removes least recently used entries down to 90% of max_bytes
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = total - int(0.9 * self.max_bytes)
+        removed = 0
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if removed >= target:
+                break
+            keys.append((key,))
+            removed = removed + size
+
+        conn.executemany('DELETE FROM cache WHERE key = ?', keys)
+        conn.commit()
+
+    def evict(self):
+        with self._lock:
+            if self.file is not None:
+                self._evict(self._connection())
+
+    def clear(self):
+
+        with self._lock:
+            self._memory.clear()
+            if self.file is not None:
+                conn = self._connection()
+                conn.execute('DELETE FROM cache')
+                conn.commit()
+
+    def size(self):
+        # bytes of values in the store
+
+        if self.file is None:
+            return 0
+
+        with self._lock:
+            conn = self._connection()
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def stats(self):
+
+        calls = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / calls if calls > 0 else 0.0,
+            'memory_items': len(self._memory),
+        }
+
+
+class BoundedDict:
+    # thread safe in memory cache of at most max_size items, the oldest are
+    # dropped first, e.g. per process caches of processors shared by threads
+    # max_size: 0 keeps nothing
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks do not survive pickling, the items do
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def set(self, key, value):
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._items.items())
+
+
+_cache = DiskCache(os.path.join(CACHE_DIR, 'cache.sqlite')) if CACHE_DIR is not None else None
+
+
+def set_cache(cache):
+    # sets the cache used by memoized functions, None disables caching
+
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
+
+
+def memoize(namespace, key=None):
+    # memoizes func in the cache set by set_cache
+    # key(*args, **kwargs) returns the picklable cache key of a call,
+    # e.g. the text and processor config, or None to not cache the call
+    # by default all arguments are part of the key
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            cache = _cache
+            if cache is None:
+                return func(*args, **kwargs)
+
+            call_key = key(*args, **kwargs) if key is not None else (args, kwargs)
+            if call_key is None:
+                return func(*args, **kwargs)
+
+            call_key = make_key(namespace, call_key)
+            res = cache.get(call_key, _missing)
+            if res is _missing:
+                res = func(*args, **kwargs)
+                cache.set(call_key, res)
+
+            return res
+
+        return wrapper
+
+    return decorator
@@ -1,3 +1,7 @@
+import math
+from collections.abc import Sequence
+
+
 def chunk_dict(data,
                chunk=10000,
                max_tasks=None,):
@@ -8,7 +12,7 @@ def chunk_dict(data,
 
         if len(curr_dict) >= chunk:
             data_list.append(curr_dict)
-            curr_dict = []
+            curr_dict = {}
 
         if max_tasks is not None and len(data_list) >= max_tasks:
             break
@@ -19,3 +23,82 @@ def chunk_dict(data,
         data_list.append(curr_dict)
 
     return data_list
+
+
+def _records(data):
+    return data.items() if isinstance(data, dict) else data
+
+
+def len_cost(field=None):
+    # cost function using the length of a record value, or of one of its fields
+    # e.g. len_cost('body') for article dicts, len_cost('timestamps') for title dicts
+
+    def cost(key, value):
+        item = value if field is None else value.get(field)
+        return len(item) if item else 1
+
+    return cost
+
+
+def chunk_iter(records,
+               chunk=10000,
+               cost=None,
+               max_cost=None,
+               max_tasks=None):
+    # lazily splits records into dict chunks
+    # records: dict, or any iterable of (key, value) pairs
+    # chunk: max number of records per chunk, None for no limit
+    # cost: cost(key, value) estimates the work of a record, default 1
+    # max_cost: a chunk is closed before its total cost would exceed max_cost,
+    #   a record costing more than max_cost gets a chunk of its own
+    # max_tasks: max number of chunks to emit
+
+    count = 0
+    curr_dict = {}
+    curr_cost = 0
+    for k, v in _records(records):
+
+        c = cost(k, v) if cost is not None else 1
+
+        if len(curr_dict) > 0 and (
+                (chunk is not None and len(curr_dict) >= chunk)
+                or (max_cost is not None and curr_cost + c > max_cost)):
+            yield curr_dict
+            count = count + 1
+            curr_dict = {}
+            curr_cost = 0
+
+            if max_tasks is not None and count >= max_tasks:
+                return
+
+        curr_dict[k] = v
+        curr_cost = curr_cost + c
+
+    if len(curr_dict) > 0:
+        yield curr_dict
+
+
+def balanced_chunks(records,
+                    num_workers,
+                    chunks_per_worker=4,
+                    cost=None,
+                    total_cost=None,
+                    max_tasks=None):
+    # lazily splits records into about num_workers * chunks_per_worker
+    # chunks of similar total cost
+    # without total_cost, records are iterated twice, once to sum the cost,
+    # records that are not a dict or a sequence are read into a list first
+
+    if total_cost is None:
+        if not isinstance(records, (dict, Sequence)):
+            records = list(records)
+        total_cost = sum(cost(k, v) if cost is not None else 1
+                         for k, v in _records(records))
+
+    max_cost = max(1, math.ceil(total_cost / (num_workers * chunks_per_worker)))
+
+    return chunk_iter(records,
+                      chunk=None,
+                      cost=cost,
+                      max_cost=max_cost,
+                      max_tasks=max_tasks)
@@ -43,3 +43,10 @@ def str_to_date(date_string):
     return date
 
 
+def str_to_dates(date_strings):
+    # batch str_to_date, parses all date strings in one pass
+    # returns DatetimeIndex, or Series with the same index for a Series
+
+    import pandas as pd
+
+    return pd.to_datetime(date_strings, format="%b %d, %Y,  %H:%M ET")
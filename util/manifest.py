@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+
+def chunk_hash(data):
+    # hash of the input keys of a chunk
+    # dict chunks hash their keys, other chunks hash their items
+
+    if isinstance(data, dict):
+        items = data.keys()
+    elif isinstance(data, (list, tuple, set, frozenset)):
+        items = data
+    else:
+        items = [data]
+
+    h = hashlib.sha1()
+    for item in sorted(repr(i) for i in items):
+        h.update(item.encode('utf8'))
+        h.update(b'\n')
+
+    return h.hexdigest()
+
+
+class Manifest:
+    # records completed chunks of a run as json lines in path/manifest.jsonl
+    # each line holds the chunk index and the hash of its input keys
+    # lines are only appended, the last entry for an index wins
+
+    def __init__(self, path, file_name='manifest.jsonl'):
+        self.path = path
+        self.file = os.path.join(path, file_name)
+        self.entries = self.load()
+
+    def load(self):
+
+        entries = {}
+        if not os.path.exists(self.file):
+            return entries
+
+        with open(self.file, 'r') as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partially written line from a crashed run
+                    continue
+                entries[entry['idx']] = entry['hash']
+
+        return entries
+
+    def shard_file(self, idx):
+        return os.path.join(self.path, f'{idx}.pkl')
+
+    def is_done(self, idx, data_hash):
+        return self.entries.get(idx) == data_hash \
+            and os.path.exists(self.shard_file(idx))
+
+    def mark_done(self, idx, data_hash):
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.file, 'a') as handle:
+            handle.write(json.dumps({'idx': idx, 'hash': data_hash}) + '\n')
+            handle.flush()
+
+        self.entries[idx] = data_hash
+
+    def done(self):
+        return sorted(idx for idx in self.entries
+                      if os.path.exists(self.shard_file(idx)))
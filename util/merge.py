@@ -0,0 +1,135 @@
+import os
+import re
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from andromeda.util import read_pickle, write_pickle
+from andromeda.util.manifest import Manifest
+
+
+class _Merger:
+    # incrementally merges shard results of the same structure
+    # dicts are updated, lists extended, dataframes and series concatenated,
+    # tuples are merged element by element
+
+    def __init__(self, concat_every=16):
+        self.concat_every = concat_every
+        self.merged = None
+
+    def _merge(self, merged, res):
+
+        import pandas as pd
+
+        if res is None:
+            return merged
+        if merged is None:
+            if isinstance(res, (pd.DataFrame, pd.Series)):
+                return [res]
+            if isinstance(res, tuple):
+                return tuple(self._merge(None, r) for r in res)
+            if isinstance(res, dict):
+                return dict(res)
+            if isinstance(res, list):
+                return list(res)
+            raise ValueError(f"can not merge results of type {type(res)}")
+
+        if isinstance(res, tuple):
+            return tuple(self._merge(m, r) for m, r in zip(merged, res))
+        if isinstance(res, (pd.DataFrame, pd.Series)):
+            merged.append(res)
+            if len(merged) >= self.concat_every:
+                # bounds the number of frames held
+                merged[:] = [pd.concat(merged)]
+            return merged
+
+        if isinstance(res, dict):
+            merged.update(res)
+        else:
+            merged.extend(res)
+
+        return merged
+
+    def add(self, res):
+        self.merged = self._merge(self.merged, res)
+
+    def _result(self, merged):
+
+        import pandas as pd
+
+        if isinstance(merged, tuple):
+            return tuple(self._result(m) for m in merged)
+        if isinstance(merged, list) and len(merged) > 0 \
+                and isinstance(merged[0], (pd.DataFrame, pd.Series)):
+            return pd.concat(merged)
+
+        return merged
+
+    def result(self):
+        return self._result(self.merged)
+
+
+def shard_files(path, idx=None):
+    # shard files {idx}.pkl written by multi_run, in index order
+    # idx: indexes of the shards to use, e.g. range(len(data_list)) of the
+    #   last run, default the completed chunks of the manifest of path if
+    #   there is one, so shards left behind by other runs are not used,
+    #   else every shard file
+
+    if idx is None and os.path.exists(os.path.join(path, 'manifest.jsonl')):
+        idx = Manifest(path).done()
+
+    if idx is not None:
+        files = [os.path.join(path, f'{i}.pkl') for i in sorted(idx)]
+        return [file for file in files if os.path.exists(file)]
+
+    shards = []
+    for name in os.listdir(path):
+        m = re.fullmatch(r'(\d+)\.pkl', name)
+        if m is not None:
+            shards.append((int(m.group(1)), os.path.join(path, name)))
+
+    return [file for _, file in sorted(shards)]
+
+
+def merge_shards(path,
+                 num_workers=4,
+                 max_pending=None,
+                 concat_every=16,
+                 out=None,
+                 idx=None):
+    # merges the shards of a multi_run output path into one result
+    # shards are read in parallel but merged in index order,
+    # with at most max_pending shards loaded ahead of the merge
+    # e.g. for process_articles: articles, fail_art, inva_art = merge_shards(path)
+    # where fail_art and inva_art can be chunked and resubmitted
+    # out: optional file to write the merged result to with write_pickle
+    # idx: indexes of the shards to merge, see shard_files
+
+    files = shard_files(path, idx=idx)
+    max_pending = max_pending if max_pending is not None else 2 * num_workers
+    print(f'merging {len(files)} shards from {path}')
+
+    merger = _Merger(concat_every=concat_every)
+    with ThreadPool(num_workers) as pool:
+
+        pending = deque()
+        files = iter(files)
+        for file in files:
+            pending.append(pool.apply_async(read_pickle, (file,)))
+            if len(pending) >= max_pending:
+                break
+
+        while len(pending) > 0:
+            res = pending.popleft().get()
+            file = next(files, None)
+            if file is not None:
+                pending.append(pool.apply_async(read_pickle, (file,)))
+            merger.add(res)
+
+    res = merger.result()
+
+    if out is not None:
+        print(f'writing merged results to {out}')
+        write_pickle(res, out)
+
+    return res
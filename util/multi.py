@@ -1,7 +1,59 @@
-import multiprocessing as mp
+import asyncio
+import inspect
 import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from andromeda.util import write_pickle
+from andromeda.util.manifest import Manifest, chunk_hash
+from andromeda.util.telemetry import Profiler, measure
+
+
+# result of one chunk of a run
+# idx: position of the chunk in data_list
+# result: return value of func, None if not kept or failed
+# error: formatted traceback if the chunk failed, else None
+# stats: measurements of the chunk in its worker, see telemetry.measure
+ChunkResult = namedtuple('ChunkResult', ['idx', 'result', 'error', 'stats'], defaults=(None,))
+
+
+class Progress:
+    # tracks completed tasks, failures and throughput of a run
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.start = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, failed=False):
+        self.done = self.done + 1
+        if failed:
+            self.failed = self.failed + 1
+
+    def skip(self):
+        self.skipped = self.skipped + 1
+
+    def __str__(self):
+        total = self.total if self.total is not None else '?'
+        return f'completed {self.done} of {total} tasks, ' \
+               f'failed {self.failed}, skipped {self.skipped}, ' \
+               f'{self.rate:.2f} tasks/s'
 
 
 def _save_data(res, path, idx):
@@ -17,42 +69,424 @@ def _save_data(res, path, idx):
 def multi_process(func, path, idx, data, ignore, **kwargs):
 
     if path is not None:
-        if not ignore and os.path.exists(path):
-            print(f"data already exist for {path}")
+        file = os.path.join(path, f'{idx}.pkl')
+        if not ignore and os.path.exists(file):
+            print(f"data already exist for {file}")
             return
         res = func(data, **kwargs)
         _save_data(res, path, idx)
     else:
-        func(data, **kwargs)
+        res = func(data, **kwargs)
 
+    return res
 
-def multi_run(func,
-              path,
-              data_list,
-              num_workers=10,
-              ignore=False,
-              **kwargs):
 
-    print(f'processing {len(data_list)} tasks...')
+async def multi_process_async(func, path, idx, data, ignore, **kwargs):
+    # multi_process for coroutine functions
+
+    if path is not None:
+        file = os.path.join(path, f'{idx}.pkl')
+        if not ignore and os.path.exists(file):
+            print(f"data already exist for {file}")
+            return
+        res = await func(data, **kwargs)
+        _save_data(res, path, idx)
+    else:
+        res = await func(data, **kwargs)
+
+    return res
+
+
+def _init_worker(initializer, initargs, processors):
+    # runs once in every worker before any chunk
+
+    if processors is not None:
+        from andromeda.nlp.processor import init_processors
+        init_processors(processors)
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _items(data):
+    return len(data) if hasattr(data, '__len__') else None
+
+
+def _run_chunk(kwargs, keep_result):
+    # runs one chunk in a worker, exceptions are returned instead of raised
+
+    idx = kwargs['idx']
+    with measure(_items(kwargs['data']), cpu_clock=time.thread_time) as stats:
+        try:
+            res = multi_process(**kwargs)
+            res = ChunkResult(idx, res if keep_result else None, None)
+        except Exception:
+            res = ChunkResult(idx, None, traceback.format_exc())
+
+    return res._replace(stats=stats)
+
+
+async def _run_chunk_async(kwargs, keep_result, executor):
+    # runs one chunk on the event loop, sync functions run in the executor
+
+    if not inspect.iscoroutinefunction(kwargs['func']):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, _run_chunk, kwargs, keep_result)
+
+    idx = kwargs['idx']
+    with measure(_items(kwargs['data']), cpu_clock=time.thread_time) as stats:
+        try:
+            res = await multi_process_async(**kwargs)
+            res = ChunkResult(idx, res if keep_result else None, None)
+        except Exception:
+            res = ChunkResult(idx, None, traceback.format_exc())
+
+    return res._replace(stats=stats)
+
+
+def _close_pool(pool, wait):
+    # without wait, chunks still running in worker processes are stopped
+
+    if not wait and isinstance(pool, ProcessPoolExecutor):
+        for proc in list((pool._processes or {}).values()):
+            proc.terminate()
+
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_pool(make_pool, tasks, keep_result, max_pending):
+    # submits tasks to a process or thread pool, yields results as they complete
+    # if a worker process dies, e.g. killed out of memory, every chunk pending
+    # in its pool is lost, not only the one that killed it. the lost chunks
+    # are run again one at a time in a new pool, and a chunk is only reported
+    # as failed if it also kills its worker when it runs alone
+
+    completed = queue.Queue()
+    pending = {}
+    lost = deque()
+    exhausted = False
+    pool = make_pool()
+    finished = False
+
+    def submit(kwargs, alone=False):
+        nonlocal pool
+
+        try:
+            future = pool.submit(_run_chunk, kwargs, keep_result)
+        except BrokenProcessPool:
+            _close_pool(pool, wait=True)
+            pool = make_pool()
+            future = pool.submit(_run_chunk, kwargs, keep_result)
+
+        pending[future] = (kwargs, pool, alone)
+        future.add_done_callback(completed.put)
+
+    try:
+        while True:
+
+            if len(lost) > 0:
+                # retries wait for the chunks of the broken pool to be lost too
+                if len(pending) == 0:
+                    submit(lost.popleft(), alone=True)
+
+            while len(lost) == 0 and not exhausted and len(pending) < max_pending:
+                try:
+                    kwargs = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                submit(kwargs)
+
+            if len(pending) == 0:
+                break
+
+            future = completed.get()
+            kwargs, future_pool, alone = pending.pop(future)
+            idx = kwargs['idx']
+
+            try:
+                res = future.result()
+            except BrokenProcessPool as e:
+                if future_pool is pool:
+                    _close_pool(pool, wait=True)
+                    pool = make_pool()
+                if not alone:
+                    lost.append(kwargs)
+                    continue
+                res = ChunkResult(idx, None, f'worker process died: {e!r}')
+            except Exception as e:
+                # e.g. the result can not be sent back
+                res = ChunkResult(idx, None, repr(e))
+
+            yield res
+
+        finished = True
 
-    pool = mp.Pool(num_workers)
-    with mp.Manager() as manager:
+    finally:
+        _close_pool(pool, wait=finished)
+
+
+async def _cancel_tasks():
+    # cancels the other tasks of the running loop and waits for them
+
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _iter_asyncio(tasks, keep_result, concurrency):
+    # runs up to concurrency tasks at a time on an event loop in a background
+    # thread, yields results as they complete
+    # the loop has its own thread so this also works when called from a
+    # running event loop, e.g. in jupyter
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    executor = ThreadPoolExecutor(concurrency)
+    completed = queue.Queue()
+    pending = {}
+    exhausted = False
+
+    try:
+        while True:
+
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    kwargs = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                future = asyncio.run_coroutine_threadsafe(
+                    _run_chunk_async(kwargs, keep_result, executor), loop)
+                pending[future] = kwargs['idx']
+                future.add_done_callback(completed.put)
+
+            if len(pending) == 0:
+                break
+
+            future = completed.get()
+            idx = pending.pop(future)
+
+            try:
+                res = future.result()
+            except Exception as e:
+                res = ChunkResult(idx, None, repr(e))
+
+            yield res
+
+    finally:
+        asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        executor.shutdown(wait=True)
+        loop.close()
+
+
+def multi_run_iter(func,
+                   path,
+                   data_list,
+                   num_workers=10,
+                   ignore=False,
+                   keep_result=True,
+                   max_pending=None,
+                   verbose=True,
+                   initializer=None,
+                   initargs=(),
+                   processors=None,
+                   backend='process',
+                   concurrency=None,
+                   profiler=None,
+                   **kwargs):
+    # runs func over every chunk of data_list
+    # yields ChunkResult as chunks complete, in completion order
+    # at most max_pending chunks are submitted ahead of the consumer
+    # with a path, completed chunks are recorded in a manifest and
+    # chunks already done with unchanged input keys are skipped,
+    # unless ignore is set, skipped chunks are not yielded
+    # processors: names (or dict of name to factory) of processors from
+    # andromeda.nlp.processor to load once per worker, see get_processor
+    # initializer(*initargs) is also called once per worker process, or once
+    #   in this process for the thread and asyncio backends
+    # backend:
+    #   'process': pool of num_workers processes, for cpu bound funcs
+    #   'thread': pool of concurrency threads, for io bound funcs
+    #   'asyncio': up to concurrency chunks on an event loop in a background thread,
+    #     func can be a coroutine function, sync funcs run in threads
+    # concurrency: number of threads or concurrent chunks, default num_workers
+    # profiler: telemetry.Profiler collecting the chunk measurements of every
+    #   worker under stage multi_run:<func name>
+
+    if backend not in ('process', 'thread', 'asyncio'):
+        raise ValueError(f"unknown backend: {backend}")
+
+    total = len(data_list) if hasattr(data_list, '__len__') else None
+    progress = Progress(total)
+    concurrency = concurrency if concurrency is not None else num_workers
+    workers = num_workers if backend == 'process' else concurrency
+    max_pending = max_pending if max_pending is not None else 2 * workers
+
+    manifest = Manifest(path) if path is not None else None
+    hashes = {}
+    stage = f"multi_run:{getattr(func, '__name__', 'func')}"
+
+    def tasks():
 
         for idx, data in enumerate(data_list):
 
+            if manifest is not None:
+                data_hash = chunk_hash(data)
+                if not ignore and manifest.is_done(idx, data_hash):
+                    progress.skip()
+                    continue
+                hashes[idx] = data_hash
+
             curr_kwargs = dict(
                 func=func,
                 path=path,
                 idx=idx,
                 data=data,
-                ignore=ignore,
+                # the manifest decides what to skip
+                ignore=ignore or manifest is not None,
             )
             curr_kwargs.update(kwargs)
 
-            pool.apply_async(multi_process, kwds=curr_kwargs)
+            yield curr_kwargs
+
+    if backend != 'process':
+        # threads share the processors of this process, load them once here
+        # instead of once per thread
+        _init_worker(initializer, initargs, processors)
+
+    if backend == 'asyncio':
+        results = _iter_asyncio(tasks(), keep_result, concurrency)
+    else:
+
+        def make_pool():
+            if backend == 'process':
+                return ProcessPoolExecutor(workers,
+                                           initializer=_init_worker,
+                                           initargs=(initializer, initargs, processors))
+            return ThreadPoolExecutor(workers)
+
+        results = _iter_pool(make_pool, tasks(), keep_result, max_pending)
+
+    try:
+        for res in results:
+
+            progress.update(failed=res.error is not None)
+
+            if profiler is not None and res.stats is not None:
+                profiler.add(stage, res.stats)
+
+            if manifest is not None:
+                data_hash = hashes.pop(res.idx)
+                if res.error is None and os.path.exists(manifest.shard_file(res.idx)):
+                    manifest.mark_done(res.idx, data_hash)
+
+            if verbose:
+                if res.error is not None:
+                    print(f'task {res.idx} failed:\n{res.error}')
+                print(progress)
+
+            yield res
+
+    finally:
+        results.close()
+
+
+def multi_run(func,
+              path,
+              data_list,
+              num_workers=10,
+              ignore=False,
+              initializer=None,
+              initargs=(),
+              processors=None,
+              backend='process',
+              concurrency=None,
+              profile_file=None,
+              **kwargs):
+    # runs func over every chunk of data_list
+    # returns dict of failed chunk index to traceback
+    # see multi_run_iter for the options
+    # profile_file: json file to write the per stage and per worker summary to
+
+    total = len(data_list) if hasattr(data_list, '__len__') else 'streamed'
+    print(f'processing {total} tasks...')
+
+    profiler = Profiler()
+    failures = {}
+    for res in multi_run_iter(func,
+                              path,
+                              data_list,
+                              num_workers=num_workers,
+                              ignore=ignore,
+                              keep_result=False,
+                              initializer=initializer,
+                              initargs=initargs,
+                              processors=processors,
+                              backend=backend,
+                              concurrency=concurrency,
+                              profiler=profiler,
+                              **kwargs):
+        if res.error is not None:
+            failures[res.idx] = res.error
+
+    profiler.report()
+    if profile_file is not None:
+        print(f'writing profile to {profile_file}')
+        profiler.write_summary(profile_file)
+
+    return failures
+
+
+def map_chunks(func, items, num_workers=None, chunk=10000, backend='process', **kwargs):
+    # runs func over chunks of items and joins the results in order
+    # func(items, **kwargs) returns one result per item, as a list, or as a
+    #   series or dataframe with the index of items
+    # items: list, or series, whose chunks are series
+    # returns list of results, or series with the index of items, or the
+    #   concatenated series or dataframes of func
+    # num_workers: None runs func on all items in this process, else chunks
+    #   of chunk items run in multi_run_iter with backend
+    # a failed chunk raises RuntimeError with its traceback
+
+    import pandas as pd
+
+    index = items.index if isinstance(items, pd.Series) else None
+    if index is None:
+        items = list(items)
+
+    if num_workers is None or len(items) == 0:
+        parts = [func(items, **kwargs)]
+    else:
+        chunks = (items[i:i + chunk] if index is None else items.iloc[i:i + chunk]
+                  for i in range(0, len(items), chunk))
+        parts = {}
+        for res in multi_run_iter(func, None, chunks,
+                                  num_workers=num_workers,
+                                  backend=backend,
+                                  verbose=False,
+                                  **kwargs):
+            if res.error is not None:
+                raise RuntimeError(f'failed to process chunk {res.idx}:\n{res.error}')
+            parts[res.idx] = res.result
+
+        parts = [parts[idx] for idx in sorted(parts)]
+
+    if isinstance(parts[0], (pd.Series, pd.DataFrame)):
+        return pd.concat(parts)
+
+    res = [r for part in parts for r in part]
+    if index is not None:
+        return pd.Series(res, index=index)
 
-        pool.close()
-        pool.join()
+    return res
 
 
 if __name__ == '__main__':
@@ -61,6 +495,9 @@ if __name__ == '__main__':
 
     def test_func(x):
         print(x * x)
+        return x * x
 
     multi_run(func=test_func, path=None, data_list=data_list)
 
+    for res in multi_run_iter(func=test_func, path=None, data_list=data_list, num_workers=2):
+        print(res)
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+
+
+def _ensure_dir(file):
+
+    path = os.path.dirname(file)
+    if len(path) > 0:
+        os.makedirs(path, exist_ok=True)
+
+
+def write_table(data,
+                file,
+                compression='zstd',
+                row_group_size=100000,
+                ensure_exist=True):
+    # writes a dataframe to a compressed columnar (parquet) file
+    # row groups of row_group_size rows allow reading row ranges
+    # word vector columns should go to write_array instead
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if ensure_exist:
+        _ensure_dir(file)
+
+    table = pa.Table.from_pandas(data)
+    pq.write_table(table,
+                   file,
+                   compression=compression,
+                   row_group_size=row_group_size)
+
+
+def _row_index(pf, res, start):
+    # a default range index of the file is read back as 0..n for a row range,
+    # this restores the index of the rows in the file
+
+    import pandas as pd
+
+    metadata = pf.schema_arrow.pandas_metadata or {}
+    index_columns = metadata.get('index_columns', [])
+    if len(index_columns) == 1 and isinstance(index_columns[0], dict) \
+            and index_columns[0].get('kind') == 'range':
+        index = index_columns[0]
+        first = index['start'] + start * index['step']
+        res.index = pd.RangeIndex(first, first + len(res) * index['step'], index['step'], name=index['name'])
+
+    return res
+
+
+def read_table(file, columns=None, rows=None, memory_map=True):
+    # reads a dataframe written by write_table
+    # columns: list of columns to load, None for all, the index is always kept
+    # rows: (start, stop) row range to load, None for all
+    # only the row groups overlapping rows are read
+
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(file, memory_map=memory_map)
+
+    if rows is None:
+        table = pf.read(columns=columns, use_pandas_metadata=True)
+        return table.to_pandas()
+
+    start, stop = rows
+    num_rows = pf.metadata.num_rows
+    start = max(0, start if start >= 0 else num_rows + start)
+    stop = min(num_rows, stop if stop >= 0 else num_rows + stop)
+
+    groups = []
+    first_row = None
+    offset = 0
+    for i in range(pf.num_row_groups):
+        group_rows = pf.metadata.row_group(i).num_rows
+        if offset < stop and offset + group_rows > start:
+            if first_row is None:
+                first_row = offset
+            groups.append(i)
+        offset = offset + group_rows
+
+    if len(groups) == 0:
+        # empty range, keeps the columns and index of the file
+        groups = [0] if pf.num_row_groups > 0 else []
+        table = pf.read_row_groups(groups, columns=columns, use_pandas_metadata=True)
+        return _row_index(pf, table.slice(0, 0).to_pandas(), start)
+
+    table = pf.read_row_groups(groups, columns=columns, use_pandas_metadata=True)
+    table = table.slice(start - first_row, stop - start)
+
+    return _row_index(pf, table.to_pandas(), start)
+
+
+def table_rows(file):
+    # number of rows of a file written by write_table
+
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(file).metadata.num_rows
+
+
+def write_array(data, file, ensure_exist=True):
+    # writes a matrix to a .npy file that can be memory mapped by read_array
+    # data: numpy array, or sequence of equal length vectors, e.g. a wv column
+
+    if ensure_exist:
+        _ensure_dir(file)
+
+    if not isinstance(data, np.ndarray):
+        data = np.stack(list(data))
+
+    np.save(file, data, allow_pickle=False)
+
+
+def read_array(file, rows=None, mmap=True):
+    # reads a matrix written by write_array
+    # mmap: memory map the file read only, pages are loaded when accessed
+    # rows: (start, stop) row range, still memory mapped if mmap is set
+
+    # row ranges are sliced from the mapped file, so only they are read
+    data = np.load(file, mmap_mode='r', allow_pickle=False)
+
+    if rows is not None:
+        start, stop = rows
+        data = data[start:stop]
+
+    return data if mmap else np.array(data)
@@ -0,0 +1,199 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from andromeda.util.cache import get_cache
+
+
+def peak_rss():
+    # peak resident set size of this process in bytes, None if unknown
+
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on mac
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+
+def worker_name():
+    # process id, plus thread name outside the main thread
+
+    thread = threading.current_thread()
+    if thread is threading.main_thread():
+        return str(os.getpid())
+
+    return f'{os.getpid()}:{thread.name}'
+
+
+def _cache_counts():
+
+    cache = get_cache()
+    if cache is None:
+        return 0, 0
+
+    return cache.hits, cache.misses
+
+
+@contextmanager
+def measure(items=None, cpu_clock=time.process_time):
+    # measures the enclosed block, yields a dict filled in on exit with
+    # wall and cpu seconds, peak rss, items and cache hits/misses
+    # items can also be set on the dict inside the block
+
+    stats = {'items': items}
+    hits, misses = _cache_counts()
+    wall = time.perf_counter()
+    cpu = cpu_clock()
+
+    try:
+        yield stats
+    finally:
+        end_hits, end_misses = _cache_counts()
+        stats.update({
+            'worker': worker_name(),
+            'wall': time.perf_counter() - wall,
+            'cpu': cpu_clock() - cpu,
+            'peak_rss': peak_rss(),
+            'cache_hits': end_hits - hits,
+            'cache_misses': end_misses - misses,
+        })
+
+
+class Profiler:
+    # collects measurements per stage and per worker of a pipeline run
+    # e.g.
+    #   with profiler.stage('create_svo', items=len(data)):
+    #       ...
+    #   profiler.write_summary('profile.json')
+
+    def __init__(self):
+        self.stages = {}
+        self.workers = {}
+        self._lock = threading.Lock()
+        self.start = time.time()
+
+    @staticmethod
+    def _add(totals, stats):
+
+        totals['calls'] = totals.get('calls', 0) + 1
+        for k in ['items', 'wall', 'cpu', 'cache_hits', 'cache_misses']:
+            if stats.get(k) is not None:
+                totals[k] = totals.get(k, 0) + stats[k]
+        if stats.get('peak_rss') is not None:
+            totals['peak_rss'] = max(totals.get('peak_rss', 0), stats['peak_rss'])
+
+    def add(self, name, stats):
+        # records the measurement of one call of a stage, see measure
+
+        with self._lock:
+            self._add(self.stages.setdefault(name, {}), stats)
+            worker = self.workers.setdefault(stats.get('worker', worker_name()), {})
+            self._add(worker.setdefault(name, {}), stats)
+
+    @contextmanager
+    def stage(self, name, items=None):
+        # measures the enclosed block as a call of stage name
+
+        with measure(items) as stats:
+            yield stats
+        self.add(name, stats)
+
+    @staticmethod
+    def _rates(totals):
+
+        res = dict(totals)
+        wall = res.get('wall', 0)
+        items = res.get('items')
+        res['items_per_sec'] = items / wall if items is not None and wall > 0 else None
+
+        calls = res.get('cache_hits', 0) + res.get('cache_misses', 0)
+        res['cache_hit_rate'] = res.get('cache_hits', 0) / calls if calls > 0 else None
+
+        return res
+
+    def summary(self):
+
+        with self._lock:
+            return {
+                'elapsed': time.time() - self.start,
+                'stages': {k: self._rates(v) for k, v in self.stages.items()},
+                'workers': {w: {k: self._rates(v) for k, v in stages.items()}
+                            for w, stages in self.workers.items()},
+            }
+
+    def write_summary(self, file):
+
+        path = os.path.dirname(file)
+        if len(path) > 0:
+            os.makedirs(path, exist_ok=True)
+
+        with open(file, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2)
+
+    def report(self):
+        # prints one line per stage
+
+        for name, s in self.summary()['stages'].items():
+            rate = f"{s['items_per_sec']:.2f} items/s" if s['items_per_sec'] is not None else 'n/a'
+            print(f"stage {name}: calls {s['calls']}, wall {s['wall']:.2f}s, "
+                  f"cpu {s['cpu']:.2f}s, {rate}")
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    # profiler of this process used by pipeline stages
+
+    return _profiler
+
+
+def set_profiler(profiler):
+
+    global _profiler
+    _profiler = profiler
+
+
+def profile_stage(name, items=None):
+    # measures the enclosed block as a stage of the process profiler
+
+    return _profiler.stage(name, items)
+
+
+def profiled(name=None, items=None):
+    # decorator measuring every call of func as a stage of the process profiler
+    # name: stage name, default the function name
+    # items(*args, **kwargs) counts the items of a call,
+    #   default the length of the first argument
+
+    def decorator(func):
+
+        stage = name if name is not None else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if items is not None:
+                count = items(*args, **kwargs)
+            else:
+                count = len(args[0]) if len(args) > 0 and hasattr(args[0], '__len__') else None
+
+            with profile_stage(stage, count):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,10 +1,35 @@
+import threading
+
 import requests
 
 from andromeda.web.html_parser import PRNewswireParser
-from andromeda.nlp.util import clean_sentence, is_english
+from andromeda.nlp.util import clean_sentence, LanguageFilter
 from andromeda.util import read_pickle, nkeys
 
 
+_local = threading.local()
+
+
+def _session():
+    # one session per thread, reuses connections across requests
+
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+
+    return _local.session
+
+
+def _language():
+    # one language filter per thread, checks the first 2000 characters of
+    # the raw article text
+    # article texts are almost all unique, so no results are cached
+
+    if not hasattr(_local, 'language'):
+        _local.language = LanguageFilter(sample_size=2000, cache_size=0)
+
+    return _local.language
+
+
 def get_archive_article(url, timestamp):
     # get article from wayback machine archive
 
@@ -12,7 +37,7 @@ def get_archive_article(url, timestamp):
 
     # print(archive_url)
 
-    r = requests.get(url=archive_url)
+    r = _session().get(url=archive_url)
 
     res = r.text
 
@@ -28,18 +53,18 @@ def process_article(title, info):
     parser = PRNewswireParser()
     parser.feed(raw)
     article = parser.res
-    article['title'] = clean_sentence(article['title'])
-    article['body'] = clean_sentence(article['body'])
 
-    try:
-        if not is_english(' '.join([article['title'], article['body']])):
-            print(f'article is not in english: {title}')
-            return None
-    except:
+    # checked before cleaning, which removes the stop words the check uses
+    english = _language().check(' '.join([article['title'], article['body']]))
+    if english is None:
         print(f'invalid article: {title}')
-        # print(' '.join([article['title'], article['body']]))
-        # print('skipping..')
         return 'invalid'
+    if not english:
+        print(f'article is not in english: {title}')
+        return None
+
+    article['title'] = clean_sentence(article['title'])
+    article['body'] = clean_sentence(article['body'])
 
     return article
 
@@ -76,8 +101,12 @@ if __name__ == '__main__':
     if platform.system() == "Darwin":
         multiprocessing.set_start_method('spawn')
 
-    from andromeda.util import chunk_dict, multi_run
+    from andromeda.util import chunk_dict, multi_run, merge_shards
     path = '/data/process_articles_res'
     data_file = '/code/test003_prnewswire_v01/data/prnews_title_dict.pkl'
     res = chunk_dict(nkeys(read_pickle(data_file), 3))
-    multi_run(process_articles, path, res)
+    # fetching is io bound, run many chunks concurrently in threads
+    multi_run(process_articles, path, res, backend='thread', concurrency=100)
+
+    articles, fail_art, inva_art = merge_shards(path)
+    print(f'articles: {len(articles)}, failed: {len(fail_art)}, invalid: {len(inva_art)}')
@@ -1,6 +1,8 @@
+from itertools import chain
+
+import numpy as np
 import pandas as pd
 import requests
-import datetime as dt
 
 from andromeda.nlp.util import clean_digits
 
@@ -93,32 +95,24 @@ def get_titles(base, max_page=1):
 
 
 def clean_titles(title_dict):
+    # title data to dataframe of cleaned titles indexed by earliest timestamp
+    # timestamps of all titles are parsed in one pass and reduced per title
 
     total = len(title_dict)
     print(f"total: {total}")
 
-    titles = []
-    dates = []
-    count = 0
-    for k, v in title_dict.items():
-
-        if count % 10000 == 0:
-            print(f"processed: {count} of {total}")
-        count = count + 1
-
-        if len(k) <= 0:
-            continue
-
-        earliest_date = dt.datetime.max
-        for str_date in v['timestamps']:
-            earliest_date = min(earliest_date, dt.datetime.strptime(str_date, '%Y%m%d%H%M%S'))
+    titles = [k for k in title_dict.keys() if len(k) > 0]
+    counts = np.array([len(title_dict[k]['timestamps']) for k in titles], dtype=np.int64)
+    timestamps = list(chain.from_iterable(title_dict[k]['timestamps'] for k in titles))
+    print(f"timestamps: {len(timestamps)}")
 
-        title = clean_digits(k)
+    dates = pd.Series(pd.to_datetime(timestamps, format='%Y%m%d%H%M%S'))
+    codes = np.repeat(np.arange(len(titles)), counts)
 
-        titles.append(title)
-        dates.append(earliest_date)
+    # titles without timestamps get NaT
+    dates = dates.groupby(codes).min().reindex(np.arange(len(titles)))
 
-    res = pd.DataFrame(data={'date': dates, 'title': titles}).set_index('date')
+    res = pd.DataFrame(data={'date': dates.values, 'title': clean_digits(titles)}).set_index('date')
     res = res.sort_index()
 
     return res